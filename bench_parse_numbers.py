@@ -0,0 +1,68 @@
+"""比較逐格 parse_number 與整欄 parse_number_series 的解析速度
+
+使用方式: python bench_parse_numbers.py [格數]
+結果同時輸出到 bench_output.txt
+"""
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from edrita import parse_number, parse_number_series
+
+def make_cells(count, seed=0):
+    """產生混合格式的儲存格(數字、千分位、金額、百分比、空白、文字)"""
+    rng = np.random.default_rng(seed)
+    values = rng.uniform(-100000, 100000, count).round(2)
+    kinds = rng.integers(0, 6, count)
+    cells = []
+    for value, kind in zip(values, kinds):
+        if kind == 0:
+            cells.append(float(value))
+        elif kind == 1:
+            cells.append(f"{value:,.2f}")
+        elif kind == 2:
+            cells.append(f"${value:,.1f}")
+        elif kind == 3:
+            cells.append(f"{value / 1000:.2f}%")
+        elif kind == 4:
+            cells.append('')
+        else:
+            cells.append('#DIV/0!')
+    return pd.Series(cells, dtype=object)
+
+def time_call(func, repeat=3):
+    """回傳多次執行中最快的一次(秒)與結果"""
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+    cells = make_cells(count)
+
+    # 逐格版本只跑一次,st.cache_data 在重複執行時會直接命中快取
+    apply_seconds, expected = time_call(lambda: cells.apply(parse_number), repeat=1)
+    series_seconds, actual = time_call(lambda: parse_number_series(cells))
+
+    if not np.allclose(expected.to_numpy(dtype='float64'), actual.to_numpy()):
+        raise SystemExit("parse_number_series 與 parse_number 結果不一致")
+
+    lines = [
+        f"cells: {count:,}",
+        f".apply(parse_number): {apply_seconds * 1000:.1f} ms",
+        f"parse_number_series: {series_seconds * 1000:.1f} ms",
+        f"speedup: {apply_seconds / series_seconds:.1f}x",
+    ]
+    output = "\n".join(lines)
+    print(output)
+    with open('bench_output.txt', 'w', encoding='utf-8') as f:
+        f.write(output + "\n")
+
+if __name__ == "__main__":
+    main()
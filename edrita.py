@@ -4,12 +4,24 @@ import plotly.express as px
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 import numpy as np
-from datetime import datetime
+from datetime import datetime, date, timedelta, timezone
+from zoneinfo import ZoneInfo
 import json
+import hashlib
+import io
+import os
+import sqlite3
 from google.oauth2.service_account import Credentials
 from googleapiclient.discovery import build
+from googleapiclient.http import HttpRequest
+import google_auth_httplib2
+import httplib2
 import re
 import time
+from bisect import bisect_left
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 import yfinance as yf
 import twstock  # 新增 twstock 匯入
 
@@ -263,7 +275,8 @@ SHEET_CONFIGS = {
         'id': '1oyG9eKrq57HMBjTWtg4tmKzHQiqc7r-2CWYyhA9ZHNc',
         'holdings_range': '總覽與損益!A:I', 
         'dca_range': '投資設定!A:E',
-        'trend_range': '資產趨勢!A:B'
+        'trend_range': '資產趨勢!A:B',
+        'trading_records_range': '交易紀錄!A:G'
     },
     'ed_overseas': {
         'schwab': {
@@ -292,6 +305,163 @@ TARGET_ALLOCATION = {
     '黃金ETF': 0
 }
 
+# 讀取數值時直接取得未格式化的數字與日期序號,省去字串解析
+SHEET_VALUE_RENDER_OPTIONS = {
+    'valueRenderOption': 'UNFORMATTED_VALUE',
+    'dateTimeRenderOption': 'SERIAL_NUMBER'
+}
+
+# Google Sheets 日期序號的起始日
+SHEETS_EPOCH = '1899-12-30'
+
+# 由本程式產生版面的工作表,依欄位位置轉換格式(不依標題猜測)
+# percent: 百分比格式,未格式化時為小數(0.123),需轉回百分比數字(12.3);date: 日期序號
+SHEET_COLUMN_FORMATS = {
+    'holdings': {'percent': [7]},       # 總覽與損益 H欄 報酬率 (=G/C)
+    'trading_records': {'date': [0]},   # 交易紀錄 A欄 交易日期
+    'trend': {'date': [0]},             # 資產趨勢 A欄 日期
+    'schwab': {'date': [0]}             # schwab A欄 日期(新增紀錄表單寫入)
+}
+
+# 海外試算表(國泰、富邦英股,嘉信與國泰共用同一本)的版面不由本程式產生,無法確定哪些欄位是百分比或日期格式,
+# 因此整本試算表改取格式化後的文字,與試算表上顯示的內容相同,再由 parse_number_series 解析
+FORMATTED_VALUE_SHEET_IDS = {config['id'] for config in SHEET_CONFIGS['ed_overseas'].values()}
+FORMATTED_VALUE_RENDER_OPTIONS = {'valueRenderOption': 'FORMATTED_VALUE'}
+
+# 本地快照設定 - 重新啟動後可直接從上次的快照顯示
+SNAPSHOT_DB_PATH = os.environ.get('EDRITA_SNAPSHOT_DB', os.path.join('.cache', 'sheet_snapshots.sqlite3'))
+
+# 只會在尾端附加資料的工作表 - 重新載入時只下載快照之後的新列
+APPEND_ONLY_WORKSHEETS = {'交易紀錄', '資產趨勢', 'schwab'}
+
+# 欄式歷史資料 - 每個代號一個 float64 原始檔,共用日期索引,讀取時以 np.memmap 對應
+COLUMN_STORE_DIR = os.path.dirname(SNAPSHOT_DB_PATH) or '.cache'
+COLUMN_STORE_DATES_FILE = '_dates.i8'
+COLUMN_STORE_SUFFIX = '.f8'
+FX_HISTORY_STORE = 'fx_history'
+PRICE_HISTORY_STORE = 'price_history'
+PRICE_HISTORY_OVERLAP_DAYS = 7
+
+# 各交易所的交易時段與休市日 - 收盤後數據不會變動,快取可保留到下次開盤
+MARKET_SESSIONS = {
+    'TWSE': {'tz': 'Asia/Taipei', 'open': (9, 0), 'close': (13, 30)},
+    'NYSE': {'tz': 'America/New_York', 'open': (9, 30), 'close': (16, 0)},
+    'LSE': {'tz': 'Europe/London', 'open': (8, 0), 'close': (16, 30)}
+}
+MARKET_HOLIDAYS = {
+    # 含春節前僅辦理結算的無交易日;2027 年依國定假日規則推算,證交所公告後再核對
+    'TWSE': {'2026-01-01', '2026-02-12', '2026-02-13', '2026-02-16', '2026-02-17', '2026-02-18', '2026-02-19',
+             '2026-02-20', '2026-02-27', '2026-04-03', '2026-04-06', '2026-05-01', '2026-06-19', '2026-09-25',
+             '2026-09-28', '2026-10-09', '2026-10-26', '2026-12-25', '2027-01-01', '2027-02-04', '2027-02-05',
+             '2027-02-08', '2027-02-09', '2027-02-10', '2027-03-01', '2027-04-05', '2027-04-06', '2027-04-30',
+             '2027-06-09', '2027-09-15', '2027-09-28', '2027-10-11', '2027-10-25', '2027-12-24'},
+    'NYSE': {'2026-01-01', '2026-01-19', '2026-02-16', '2026-04-03', '2026-05-25', '2026-06-19', '2026-07-03',
+             '2026-09-07', '2026-11-26', '2026-12-25', '2027-01-01', '2027-01-18', '2027-02-15', '2027-03-26',
+             '2027-05-31', '2027-06-18', '2027-07-05', '2027-09-06', '2027-11-25', '2027-12-24'},
+    'LSE': {'2026-01-01', '2026-04-03', '2026-04-06', '2026-05-04', '2026-05-25', '2026-08-31', '2026-12-25',
+            '2026-12-28', '2027-01-01', '2027-03-26', '2027-03-29', '2027-05-03', '2027-05-31', '2027-08-30',
+            '2027-12-27', '2027-12-28'}
+}
+
+# 各資料來源對應的交易所(未列出的台股帳戶為 TWSE)
+SOURCE_MARKETS = {
+    'schwab': ['NYSE'],
+    'cathay': ['NYSE'],
+    'fubon_uk': ['LSE']
+}
+FX_MARKETS = ['TWSE', 'NYSE', 'LSE']
+
+# 交易時段內的快取時間(秒);休市時保留到下次開盤,但最長不超過 CLOSED_MARKET_MAX_TTL_SECONDS
+SHEET_INTRADAY_TTL_SECONDS = 600
+PRICE_INTRADAY_TTL_SECONDS = 120
+FX_INTRADAY_TTL_SECONDS = 3600
+CLOSED_MARKET_MAX_TTL_SECONDS = 43200
+
+# 匯率備援 - 取得失敗時使用最後一次成功的匯率,並在短時間後重試
+FX_FALLBACK_RATE = 31.0
+FX_RETRY_SECONDS = 120
+
+# 匯率矩陣 - 各幣別兌台幣的 yfinance 代號,以及 GBP/USD 交叉匯率
+FX_PAIRS = {
+    'USDTWD': 'USDTWD=X',
+    'GBPTWD': 'GBPTWD=X',
+    'GBPUSD': 'GBPUSD=X'
+}
+FX_FALLBACK_RATES = {'USDTWD': FX_FALLBACK_RATE, 'GBPTWD': 40.0, 'GBPUSD': 1.27}
+
+# 工作表之間的公式相依關係 - 寫入左側工作表時右側工作表的數值也會改變
+WORKSHEET_DEPENDENCIES = {
+    '交易紀錄': ['總覽與損益']
+}
+
+# 並行載入的逾時設定(秒) - 單一來源逾時不會拖住整個頁面
+SOURCE_TIMEOUT_SECONDS = 20
+FX_TIMEOUT_SECONDS = 8
+
+# 股價下載 - 失敗後在 PRICE_RETRY_SECONDS 內不再重試;歷史股價超過期限時在背景繼續下載
+PRICE_RETRY_SECONDS = 120
+PRICE_TIMEOUT_SECONDS = 8
+PRICE_HISTORY_TIMEOUT_SECONDS = 5
+
+# 優化17: 依交易時段決定快取有效期間
+def get_market_session(market, day):
+    """取得交易所某日的開盤與收盤時間(UTC),休市日回傳 None"""
+    session = MARKET_SESSIONS[market]
+    if day.weekday() >= 5 or day.isoformat() in MARKET_HOLIDAYS.get(market, set()):
+        return None
+    
+    tz = ZoneInfo(session['tz'])
+    open_at = datetime(day.year, day.month, day.day, *session['open'], tzinfo=tz)
+    close_at = datetime(day.year, day.month, day.day, *session['close'], tzinfo=tz)
+    return open_at.astimezone(timezone.utc), close_at.astimezone(timezone.utc)
+
+def get_market_status(market, now):
+    """回傳 (是否開盤中, 最近一次收盤時間, 下次開盤時間)"""
+    local_today = now.astimezone(ZoneInfo(MARKET_SESSIONS[market]['tz'])).date()
+    last_close, next_open = None, None
+    
+    for offset in range(-10, 11):
+        session = get_market_session(market, local_today + timedelta(days=offset))
+        if session is None:
+            continue
+        open_at, close_at = session
+        if open_at <= now < close_at:
+            return True, None, None
+        if close_at <= now:
+            last_close = close_at
+        elif next_open is None:
+            next_open = open_at
+    
+    return False, last_close, next_open
+
+def get_cache_window(markets, intraday_ttl, now=None):
+    """
+    取得目前的快取時間窗,回傳 (快取鍵, 時間窗起點 timestamp)。
+    任一交易所開盤時以 intraday_ttl 切分;全部休市時時間窗從最近收盤延續到下次開盤,
+    最長 CLOSED_MARKET_MAX_TTL_SECONDS。
+    """
+    now = now or datetime.now(timezone.utc)
+    statuses = [get_market_status(market, now) for market in markets]
+    now_ts = now.timestamp()
+    
+    if any(is_open for is_open, _, _ in statuses):
+        bucket = int(now_ts // intraday_ttl)
+        return f"open-{bucket}", bucket * intraday_ttl
+    
+    last_closes = [last_close.timestamp() for _, last_close, _ in statuses if last_close]
+    closed_since = max(last_closes) if last_closes else 0.0
+    
+    # 休市期間仍定期更新,讓手動修改的試算表內容不會被保留太久
+    window_start = closed_since + (now_ts - closed_since) // CLOSED_MARKET_MAX_TTL_SECONDS * CLOSED_MARKET_MAX_TTL_SECONDS
+    return f"closed-{int(window_start)}", window_start
+
+def get_sources_markets(sources):
+    """取得一組範圍對應的交易所"""
+    markets = set()
+    for source in sources:
+        markets.update(SOURCE_MARKETS.get(source[5] or source[3], ['TWSE']))
+    return sorted(markets)
+
 # 優化1: 擴展快取設置
 @st.cache_resource(ttl=3600)
 def get_google_sheets_service():
@@ -308,25 +478,141 @@ def get_google_sheets_service():
             'https://www.googleapis.com/auth/spreadsheets'
         ])
         
-        return build('sheets', 'v4', credentials=scoped_credentials)
+        # httplib2 不是執行緒安全的,每個請求使用獨立的 Http 物件以支援並行載入
+        def build_request(http, *args, **kwargs):
+            new_http = google_auth_httplib2.AuthorizedHttp(scoped_credentials, http=httplib2.Http())
+            return HttpRequest(new_http, *args, **kwargs)
+        
+        authorized_http = google_auth_httplib2.AuthorizedHttp(scoped_credentials, http=httplib2.Http())
+        return build('sheets', 'v4', http=authorized_http, requestBuilder=build_request)
     except Exception as e:
         st.error(f"Google Sheets API 設置失敗: {e}")
         return None
 
-# 優化2: 延長匯率快取時間到4小時
-@st.cache_data(ttl=14400)
-def get_usd_twd_rate():
-    """取得USDTWD 匯率 - 延長快取時間"""
+# 新增:匯率備援狀態 - 記錄目前是否使用備用匯率,以及取得失敗後何時可以重試
+@st.cache_resource
+def get_fx_fallback_state():
+    """匯率備援狀態(整個程序共用)"""
+    return {'retry_after': 0.0, 'is_fallback': False}
+
+# 優化18: 多幣別匯率服務 - 一次取得所有交叉匯率,並保存每日歷史
+def get_fx_rates():
+    """取得各幣別兌台幣匯率 {'USD': ..., 'GBP': ..., 'TWD': 1.0},失敗時使用最後一次成功的匯率"""
+    state = get_fx_fallback_state()
+    if time.time() >= state['retry_after']:
+        try:
+            pair_rates = fetch_fx_matrix(get_cache_window(FX_MARKETS, FX_INTRADAY_TTL_SECONDS)[0])
+            state['is_fallback'] = False
+            return to_twd_rates(pair_rates)
+        except Exception:
+            # 失敗結果不進入快取,只在 FX_RETRY_SECONDS 內暫停重試
+            state['retry_after'] = time.time() + FX_RETRY_SECONDS
+    
+    return use_fallback_fx_rates()
+
+def use_fallback_fx_rates():
+    """改用最後一次成功的匯率,並標記為備用匯率"""
+    get_fx_fallback_state()['is_fallback'] = True
+    return to_twd_rates(get_fallback_fx_pairs())
+
+def to_twd_rates(pair_rates):
+    """將貨幣對匯率轉換為各幣別兌台幣匯率"""
+    return {'TWD': 1.0, 'USD': pair_rates['USDTWD'], 'GBP': pair_rates['GBPTWD']}
+
+def get_fallback_fx_pairs():
+    """備用匯率 - 優先使用本地保存的最後一次成功匯率"""
+    pair_rates = {}
+    for pair, default_rate in FX_FALLBACK_RATES.items():
+        last_known = read_last_known_rate(pair)
+        pair_rates[pair] = last_known if last_known is not None else default_rate
+    return pair_rates
+
+@st.cache_data(ttl=CLOSED_MARKET_MAX_TTL_SECONDS)
+def fetch_fx_matrix(cache_window):
+    """以單一 yf.download 取得所有貨幣對的每日收盤,更新本地歷史並回傳最新匯率,失敗時拋出例外"""
+    history = load_fx_history()
+    period = '5d' if not history.empty else '10y'
+    data = yf.download(list(FX_PAIRS.values()), period=period, progress=False, auto_adjust=False, threads=True)
+    if data.empty:
+        raise ValueError("yfinance 未回傳匯率")
+    
+    closes = data['Close'].rename(columns={ticker: pair for pair, ticker in FX_PAIRS.items()})
+    closes = closes.reindex(columns=list(FX_PAIRS)).ffill()
+    latest = closes.iloc[-1]
+    if latest.isna().any():
+        raise ValueError(f"缺少匯率: {', '.join(latest[latest.isna()].index)}")
+    
+    save_fx_history(closes)
+    pair_rates = {pair: float(rate) for pair, rate in latest.items()}
+    for pair, rate in pair_rates.items():
+        write_last_known_rate(pair, rate)
+    return pair_rates
+
+def load_fx_history():
+    """讀取本地的每日匯率歷史"""
     try:
-        ticker = yf.Ticker("USDTWD=X")
-        data = ticker.history(period="1d")
-        if not data.empty:
-            return data['Close'].iloc[-1]
-        else:
-            return 31.0
-    except Exception as e:
-        # 使用備用靜態匯率,減少API依賴
-        return 31.0
+        return read_column_store(FX_HISTORY_STORE, list(FX_PAIRS))
+    except (OSError, ValueError):
+        return pd.DataFrame(columns=list(FX_PAIRS))
+
+def save_fx_history(closes):
+    """將新取得的每日收盤附加到本地匯率歷史"""
+    try:
+        append_column_store(FX_HISTORY_STORE, closes)
+    except (OSError, ValueError):
+        pass
+
+def convert_to_twd(values, currencies, fx_rates=None):
+    """以向量化乘法將整欄金額換算為台幣,currencies 可為單一幣別或逐列幣別"""
+    fx_rates = fx_rates or get_fx_rates()
+    if isinstance(currencies, str):
+        return values * fx_rates[currencies]
+    return values * pd.Series(currencies, index=values.index).map(fx_rates)
+
+def convert_history_to_twd(values, currency, fx_history=None):
+    """將每日金額序列依當日匯率換算為台幣(缺少的日期沿用前一日匯率)"""
+    if currency == 'TWD':
+        return values
+    fx_history = load_fx_history() if fx_history is None else fx_history
+    pair = f'{currency}TWD'
+    pair_history = fx_history[pair].dropna().sort_index() if pair in fx_history.columns else pd.Series(dtype='float64')
+    if pair_history.empty:
+        return values * get_fx_rates()[currency]
+    # 以 asof 逐日查詢,同一天有多筆金額也不需要在重複的索引上 reindex;早於歷史起點的日期使用第一筆匯率
+    rates = pair_history.asof(values.index).fillna(pair_history.iloc[0])
+    return values * rates.to_numpy()
+
+# 新增:並行載入多個來源
+def fan_out(tasks, timeouts=None):
+    """同時執行多個載入任務並等待結果,逾時或失敗的來源回傳 None"""
+    timeouts = timeouts or {}
+    ctx = get_script_run_ctx()
+    
+    def run_with_ctx(task):
+        # 讓子執行緒可以使用 st.cache_data 與 st.error
+        if ctx is not None:
+            add_script_run_ctx(threading.current_thread(), ctx)
+        return task()
+    
+    executor = ThreadPoolExecutor(max_workers=max(len(tasks), 1))
+    started_at = time.monotonic()
+    futures = {name: executor.submit(run_with_ctx, task) for name, task in tasks.items()}
+    
+    results = {}
+    for name, future in futures.items():
+        deadline = started_at + timeouts.get(name, SOURCE_TIMEOUT_SECONDS)
+        try:
+            results[name] = future.result(timeout=max(deadline - time.monotonic(), 0))
+        except FutureTimeoutError:
+            st.warning(f"{name} 載入逾時,暫以空資料顯示")
+            results[name] = None
+        except Exception as e:
+            st.error(f"{name} 載入失敗: {e}")
+            results[name] = None
+    
+    # 不等待逾時的任務,完成後仍會寫入快取
+    executor.shutdown(wait=False, cancel_futures=True)
+    return results
 
 # 優化3: 為常用函數添加快取
 @st.cache_data
@@ -349,6 +635,44 @@ def parse_number(value):
     except (ValueError, TypeError):
         return 0.0
 
+# 優化11: 整欄向量化解析數字,避免逐格呼叫 parse_number
+def is_typed_numeric(series):
+    """判斷欄位是否為 UNFORMATTED_VALUE 回傳的純數字(忽略空白格)"""
+    if pd.api.types.is_numeric_dtype(series):
+        return True
+    inferred = pd.api.types.infer_dtype(series.replace('', np.nan), skipna=True)
+    return inferred in ('integer', 'floating', 'mixed-integer-float', 'decimal')
+
+def typed_numeric_mask(series):
+    """逐格判斷是否為 UNFORMATTED_VALUE 回傳的數字(欄位中可能混有 #DIV/0! 等文字)"""
+    if pd.api.types.is_numeric_dtype(series):
+        return pd.Series(True, index=series.index)
+    return series.map(lambda value: isinstance(value, (int, float)) and not isinstance(value, bool) and not pd.isna(value))
+
+def parse_number_series(series):
+    """以 pandas 字串方法一次解析整欄數字,格式與 parse_number 相同"""
+    if pd.api.types.is_numeric_dtype(series):
+        return series.astype('float64').fillna(0.0)
+    
+    # 已是數字的欄位直接轉為 float64,字串清理僅作為備援
+    if is_typed_numeric(series):
+        return pd.to_numeric(series.replace('', np.nan), errors='coerce').fillna(0.0).astype('float64')
+    
+    cleaned = series.astype(str).str.replace(r'[,%"$]', '', regex=True).str.strip()
+    return pd.to_numeric(cleaned, errors='coerce').fillna(0.0).astype('float64')
+
+# 新增:同一試算表的寫入在程序內依序執行,多個 session 同時送出交易也不會互相干擾
+@st.cache_resource
+def get_write_locks():
+    """各試算表的寫入鎖(整個程序共用)"""
+    return {'lock': threading.Lock(), 'locks': {}}
+
+def get_spreadsheet_write_lock(spreadsheet_id):
+    """取得單一試算表的寫入鎖"""
+    state = get_write_locks()
+    with state['lock']:
+        return state['locks'].setdefault(spreadsheet_id, threading.Lock())
+
 def append_to_sheet(spreadsheet_id, range_name, values):
     """將一列資料附加到指定的 Google Sheet 中。"""
     try:
@@ -360,22 +684,72 @@ def append_to_sheet(spreadsheet_id, range_name, values):
         body = {
             'values': values
         }
-        result = service.spreadsheets().values().append(
-            spreadsheetId=spreadsheet_id,
-            range=range_name,
-            valueInputOption='USER_ENTERED',
-            insertDataOption='INSERT_ROWS',
-            body=body
-        ).execute()
+        with get_spreadsheet_write_lock(spreadsheet_id):
+            service.spreadsheets().values().append(
+                spreadsheetId=spreadsheet_id,
+                range=range_name,
+                valueInputOption='USER_ENTERED',
+                insertDataOption='INSERT_ROWS',
+                body=body
+            ).execute()
         return True
     except Exception as e:
         st.error(f"寫入 Google Sheets 失敗: {e}")
         return False
 
+# 優化16: 離線股票代號索引 - 以 twstock 內建的代號表查詢名稱,不需網路
+@st.cache_resource
+def get_symbol_index():
+    """建立 twstock.codes 的記憶體索引(整個程序只建立一次)"""
+    infos = {code: info for code, info in twstock.codes.items() if getattr(info, 'name', None)}
+    # 權證數量龐大且不適合作為持股建議,前綴查詢只納入股票、ETF等
+    searchable = {code: info for code, info in infos.items() if '權證' not in (info.type or '')}
+    return {
+        'infos': infos,                 # 代號 -> 名稱、市場、類型、產業
+        'names': {code: info.name for code, info in infos.items()},
+        'codes': sorted(searchable),    # 排序後的代號,供前綴查詢使用
+        'name_keys': sorted((info.name, code) for code, info in searchable.items())  # 依名稱排序,供名稱前綴查詢
+    }
+
+def prefix_range(sorted_keys, prefix, limit):
+    """以 bisect 取得排序陣列中符合前綴的項目"""
+    matches = []
+    for i in range(bisect_left(sorted_keys, prefix), len(sorted_keys)):
+        key = sorted_keys[i]
+        key_text = key[0] if isinstance(key, tuple) else key
+        if not key_text.startswith(prefix) or len(matches) >= limit:
+            break
+        matches.append(key)
+    return matches
+
+def search_stock_codes(query, holding_codes=(), limit=8):
+    """依代號或名稱前綴查詢股票,目前持股優先,回傳 [(代號, 名稱)]"""
+    query = query.strip().upper()
+    if not query:
+        return []
+    
+    index = get_symbol_index()
+    names = index['names']
+    results = [(code, names.get(code, '')) for code in prefix_range(sorted(holding_codes), query, limit)]
+    if query[0].isascii():
+        results += [(code, names[code]) for code in prefix_range(index['codes'], query, limit)]
+    else:
+        results += [(code, name) for name, code in prefix_range(index['name_keys'], (query,), limit)]
+    
+    # 去除重複並保留順序
+    return list(dict.fromkeys(results))[:limit]
+
 # 新增:取得股票名稱的函數
-@st.cache_data(ttl=3600)
 def get_stock_name(stock_code):
-    """使用 twstock 取得股票名稱"""
+    """取得股票名稱 - 優先使用離線索引,未知代號才查詢網路"""
+    name = get_symbol_index()['names'].get(stock_code)
+    if name:
+        return name
+    return fetch_stock_name_online(stock_code)
+
+@st.cache_data(ttl=86400)
+def fetch_stock_name_online(stock_code):
+    """使用 twstock 即時資料取得股票名稱"""
     try:
         realtime_data = twstock.realtime.get(stock_code)
         if realtime_data and realtime_data.get('success', False):
@@ -386,29 +760,236 @@ def get_stock_name(stock_code):
         st.warning(f"無法取得股票 {stock_code} 的名稱: {e}")
         return f"股票{stock_code}"
 
-# 新增:獲取下一行號的輔助函數
-def get_next_row_number(sheet_id, range_name):
-    """獲取工作表的下一行號"""
+# 優化15: 批次股價服務 - 一次下載所有持股的股價,取代 GOOGLEFINANCE 儲存格
+def get_yahoo_ticker(stock_code):
+    """台股代號轉換為 Yahoo Finance 代號,上櫃股票使用 .TWO"""
+    code_info = get_symbol_index()['infos'].get(stock_code)
+    if code_info is not None and code_info.market == '上櫃':
+        return f"{stock_code}.TWO"
+    return f"{stock_code}.TW"
+
+@st.cache_data(ttl=CLOSED_MARKET_MAX_TTL_SECONDS)
+def fetch_market_prices(stock_codes, cache_window=None):
+    """以單一 yf.download 取得多檔股票的最新收盤價"""
+    tickers = {get_yahoo_ticker(code): code for code in stock_codes}
+    data = yf.download(list(tickers), period='5d', progress=False, auto_adjust=False, threads=True, timeout=PRICE_TIMEOUT_SECONDS)
+    if data.empty:
+        raise ValueError("yfinance 未回傳任何股價")
+    
+    closes = data['Close']
+    if isinstance(closes, pd.Series):
+        closes = closes.to_frame(name=next(iter(tickers)))
+    latest = closes.ffill().iloc[-1].dropna()
+    return {tickers[ticker]: float(price) for ticker, price in latest.items() if ticker in tickers}
+
+# 新增:股價下載失敗時暫停重試,避免每次重新執行都卡在 yfinance 逾時
+@st.cache_resource
+def get_price_backoff_state():
+    """各股價下載的下次可重試時間(整個程序共用)"""
+    return {'lock': threading.Lock(), 'retry_after': {}}
+
+def is_price_fetch_allowed(name):
+    """是否已超過下次可重試時間"""
+    state = get_price_backoff_state()
+    with state['lock']:
+        return time.time() >= state['retry_after'].get(name, 0.0)
+
+def record_price_fetch_failure(name):
+    """記錄下載失敗,PRICE_RETRY_SECONDS 內不再重試"""
+    state = get_price_backoff_state()
+    with state['lock']:
+        state['retry_after'][name] = time.time() + PRICE_RETRY_SECONDS
+
+def get_market_prices(stock_codes):
+    """取得持股的最新股價,失敗時回傳空字典(沿用試算表股價)且不快取失敗結果"""
+    stock_codes = tuple(sorted({code for code in stock_codes if code and code.isalnum()}))
+    if not stock_codes or not is_price_fetch_allowed('prices'):
+        return {}
+    try:
+        return fetch_market_prices(stock_codes, get_cache_window(['TWSE'], PRICE_INTRADAY_TTL_SECONDS)[0])
+    except Exception:
+        record_price_fetch_failure('prices')
+        return {}
+
+def download_closes(stock_codes, start):
+    """以單一 yf.download 取得多檔股票自 start 起的每日收盤價矩陣(列為日期,欄為股票代號)"""
+    tickers = {get_yahoo_ticker(code): code for code in stock_codes}
+    data = yf.download(list(tickers), start=start, progress=False, auto_adjust=False, threads=True, timeout=PRICE_TIMEOUT_SECONDS)
+    if data.empty:
+        raise ValueError("yfinance 未回傳任何歷史股價")
+    
+    closes = data['Close']
+    if isinstance(closes, pd.Series):
+        closes = closes.to_frame(name=next(iter(tickers)))
+    return closes.rename(columns=tickers).reindex(columns=list(stock_codes)).astype('float64')
+
+def read_price_history_coverage():
+    """各代號已下載的最早日期"""
+    try:
+        with open(get_column_store_path(PRICE_HISTORY_STORE, 'coverage.json'), encoding='utf-8') as coverage_file:
+            return json.load(coverage_file)
+    except (OSError, ValueError):
+        return {}
+
+def write_price_history_coverage(coverage):
+    """保存各代號已下載的最早日期"""
+    coverage_path = get_column_store_path(PRICE_HISTORY_STORE, 'coverage.json')
+    with open(coverage_path + '.tmp', 'w', encoding='utf-8') as coverage_file:
+        json.dump(coverage, coverage_file)
+    os.replace(coverage_path + '.tmp', coverage_path)
+
+@st.cache_data(ttl=CLOSED_MARKET_MAX_TTL_SECONDS)
+def sync_price_history(stock_codes, start, cache_window=None):
+    """補齊本地價格歷史:未涵蓋 start 的代號整段下載,其餘只下載最後幾個交易日"""
+    coverage = read_price_history_coverage()
+    dates, _ = load_column_store(PRICE_HISTORY_STORE)
+    missing = [code for code in stock_codes if coverage.get(code, '9999-12-31') > start]
+    existing = [code for code in stock_codes if code not in missing]
+    
+    if missing:
+        append_column_store(PRICE_HISTORY_STORE, download_closes(missing, start))
+        coverage.update({code: min(start, coverage.get(code, start)) for code in missing})
+        write_price_history_coverage(coverage)
+    if existing and len(dates):
+        tail_start = str(dates[-1] - np.timedelta64(PRICE_HISTORY_OVERLAP_DAYS, 'D'))
+        append_column_store(PRICE_HISTORY_STORE, download_closes(existing, tail_start))
+    return True
+
+def get_price_history(stock_codes, start):
+    """取得每日收盤價矩陣 - 由本地欄式歷史讀取,每個快取時間窗只向 yfinance 補抓新的交易日"""
+    stock_codes = tuple(sorted({code for code in stock_codes if code and code.isalnum()}))
+    if not stock_codes:
+        return pd.DataFrame()
+    if is_price_fetch_allowed('price_history'):
+        cache_window = get_cache_window(['TWSE'], PRICE_INTRADAY_TTL_SECONDS)[0]
+        
+        def sync():
+            try:
+                # 第一次下載多年歷史可能較久,逾時後在背景繼續,後續重新執行會等待同一個下載
+                return singleflight(
+                    (PRICE_HISTORY_STORE, stock_codes, start, cache_window),
+                    lambda: sync_price_history(stock_codes, start, cache_window),
+                    state=get_price_flight_state()
+                )
+            except Exception:
+                # 下載失敗時沿用本地已有的歷史,失敗結果不會被快取
+                record_price_fetch_failure('price_history')
+                raise
+        
+        fan_out({'歷史股價': sync}, timeouts={'歷史股價': PRICE_HISTORY_TIMEOUT_SECONDS})
+    try:
+        return read_column_store(PRICE_HISTORY_STORE, stock_codes, start)
+    except (OSError, ValueError):
+        return pd.DataFrame()
+
+def apply_market_prices(holdings_df, prices):
+    """將批次取得的股價併入持股並重新計算市值與損益"""
+    if not prices or not all(col in holdings_df.columns for col in HOLDINGS_METRIC_COLUMNS):
+        return holdings_df
+    
+    holdings_df = holdings_df.copy()
+    latest = holdings_df['股票代號'].astype(str).str.strip().map(prices)
+    mask = latest.notna()
+    if not mask.any():
+        return holdings_df
+    
+    holdings_df.loc[mask, '目前股價'] = latest[mask]
+    return recalculate_holdings_metrics(holdings_df, mask)
+
+# 新增:取得工作表 sheetId(appendCells 需要數字ID而非名稱)
+@st.cache_data(ttl=86400)
+def get_worksheet_ids(spreadsheet_id):
+    """取得試算表中各工作表名稱對應的 sheetId"""
+    service = get_google_sheets_service()
+    if not service:
+        return {}
+    
+    result = service.spreadsheets().get(
+        spreadsheetId=spreadsheet_id,
+        fields='sheets.properties(sheetId,title)'
+    ).execute()
+    return {sheet['properties']['title']: sheet['properties']['sheetId'] for sheet in result.get('sheets', [])}
+
+def to_cell_data(value):
+    """將Python數值轉換為 appendCells 的 CellData"""
+    if value is None or (isinstance(value, str) and value == ''):
+        return {}
+    if isinstance(value, str) and value.startswith('='):
+        return {'userEnteredValue': {'formulaValue': value}}
+    if isinstance(value, bool):
+        return {'userEnteredValue': {'boolValue': value}}
+    if isinstance(value, (int, float, np.number)):
+        return {'userEnteredValue': {'numberValue': float(value)}}
+    if isinstance(value, date):
+        # 日期以序號寫入並套用日期格式,與 USER_ENTERED 輸入 yyyy/mm/dd 的結果相同
+        serial = (pd.Timestamp(value).normalize() - pd.Timestamp(SHEETS_EPOCH)).days
+        return {
+            'userEnteredValue': {'numberValue': serial},
+            'userEnteredFormat': {'numberFormat': {'type': 'DATE', 'pattern': 'yyyy/mm/dd'}}
+        }
+    return {'userEnteredValue': {'stringValue': str(value)}}
+
+def to_entered_stock_code(stock_code):
+    """股票代號依 USER_ENTERED 的規則寫入:純數字且非0開頭(2330)存為數字,0050 等保留文字"""
+    stock_code = str(stock_code).strip()
+    if stock_code.isdigit() and not stock_code.startswith('0'):
+        return int(stock_code)
+    return stock_code
+
+def batch_append_to_sheets(spreadsheet_id, rows_by_worksheet):
+    """以單一 spreadsheets().batchUpdate 將多個工作表的資料一次附加,全部成功或全部失敗"""
     try:
         service = get_google_sheets_service()
         if not service:
-            return None
-        
-        result = service.spreadsheets().values().get(
-            spreadsheetId=sheet_id,
-            range=range_name
-        ).execute()
-        
-        values = result.get('values', [])
-        return len(values) + 1  # +1 因為要寫入下一行
+            st.error("無法連接至 Google Sheets 服務。")
+            return False
         
+        worksheet_ids = get_worksheet_ids(spreadsheet_id)
+        requests = []
+        for worksheet, rows in rows_by_worksheet.items():
+            if worksheet not in worksheet_ids:
+                st.error(f"找不到工作表: {worksheet}")
+                return False
+            requests.append({
+                'appendCells': {
+                    'sheetId': worksheet_ids[worksheet],
+                    'rows': [{'values': [to_cell_data(value) for value in row]} for row in rows],
+                    'fields': 'userEnteredValue,userEnteredFormat.numberFormat'
+                }
+            })
+        
+        with get_spreadsheet_write_lock(spreadsheet_id):
+            service.spreadsheets().batchUpdate(
+                spreadsheetId=spreadsheet_id,
+                body={'requests': requests}
+            ).execute()
+        return True
     except Exception as e:
-        st.error(f"獲取行號失敗: {e}")
-        return None
+        st.error(f"寫入 Google Sheets 失敗: {e}")
+        return False
+
+# 是否在新持股列寫入試算表公式 - 關閉時持股數值完全由程式依交易紀錄計算
+WRITE_HOLDINGS_FORMULAS = True
+
+# 總覽與損益的公式 - 以 INDEX(欄:欄, ROW()) 取得同列數值,不需預先讀取行號
+HOLDINGS_ROW_FORMULAS = [
+    '=IF(ISBLANK(INDEX(A:A, ROW())), "", SUMIF(\'交易紀錄\'!B:B, INDEX(A:A, ROW()), \'交易紀錄\'!F:F))',  # Column C: 總投入成本
+    '=IF(ISBLANK(INDEX(A:A, ROW())), "", SUMIF(\'交易紀錄\'!B:B, INDEX(A:A, ROW()), \'交易紀錄\'!G:G))',  # Column D: 總持有股數
+    '=IF(ISBLANK(INDEX(A:A, ROW())), "", GOOGLEFINANCE("TPE:" & INDEX(A:A, ROW()), "price"))',            # Column E: 目前股價
+    '=IF(ISBLANK(INDEX(A:A, ROW())), "", INDEX(D:D, ROW())*INDEX(E:E, ROW()))',                           # Column F: 目前總市值
+    '=IF(ISBLANK(INDEX(A:A, ROW())), "", INDEX(F:F, ROW())-INDEX(C:C, ROW()))',                           # Column G: 未實現損益
+    '=IF(ISBLANK(INDEX(A:A, ROW())), "", INDEX(G:G, ROW())/INDEX(C:C, ROW()))'                            # Column H: 報酬率
+]
+
+def build_holdings_row(stock_code, stock_name):
+    """建立總覽與損益的新持股列"""
+    if WRITE_HOLDINGS_FORMULAS:
+        return [to_entered_stock_code(stock_code), stock_name, *HOLDINGS_ROW_FORMULAS]
+    return [to_entered_stock_code(stock_code), stock_name]
 
 # 新增:交易記錄處理函數
 def process_trading_record(person, stock_code, stock_price, stock_quantity, transaction_type, holding_type, transaction_date):
-    """處理交易記錄邏輯"""
+    """處理交易記錄邏輯 - 交易紀錄與新持股在同一個請求中寫入"""
     try:
         sheet_id = SHEET_CONFIGS[person]['id']
         
@@ -421,53 +1002,40 @@ def process_trading_record(person, stock_code, stock_price, stock_quantity, tran
             final_quantity = stock_quantity * (-1)
         
         # 準備寫入交易紀錄的資料
-        trading_record_values = [[
-            transaction_date.strftime('%Y/%m/%d'),  # Column A: 交易日期
-            stock_code,                             # Column B: 股票代號
-            stock_price,                           # Column C: 買入股價
-            '',                                    # Column D: 留空
-            '',                                    # Column E: 留空
-            total_amount,                          # Column F: 計算金額
-            final_quantity                         # Column G: 股數
-        ]]
-        
-        # 寫入交易紀錄
-        success = append_to_sheet(sheet_id, '交易紀錄', trading_record_values)
-        
-        if not success:
-            return False
+        rows_by_worksheet = {
+            '交易紀錄': [[
+                transaction_date,  # Column A: 交易日期
+                to_entered_stock_code(stock_code),  # Column B: 股票代號(與總覽與損益A欄型別一致,SUMIF 才能比對)
+                stock_price,       # Column C: 買入股價
+                '',                # Column D: 留空
+                '',                # Column E: 留空
+                total_amount,      # Column F: 計算金額
+                final_quantity     # Column G: 股數
+            ]]
+        }
         
-        # 如果是「新持有」且「買進」,則額外寫入總覽與損益
+        # 如果是「新持有」且「買進」,則同時寫入總覽與損益
         if holding_type == "新持有" and transaction_type == "買進":
             stock_name = get_stock_name(stock_code)
-            
-            # 獲取將要寫入的行號
-            next_row = get_next_row_number(sheet_id, '總覽與損益!A:A')
-            if next_row is None:
-                next_row = 2  # 如果無法獲取,假設從第2行開始(第1行是標題)
-            
-            # 準備包含所有公式的資料
-            holdings_values = [[
-                stock_code,    # Column A: 股票代號
-                stock_name,    # Column B: 股票名稱
-                f'=IF(ISBLANK(A{next_row}), "", SUMIF(\'交易紀錄\'!B:B, A{next_row}, \'交易紀錄\'!F:F))',  # Column C: 總投入成本
-                f'=IF(ISBLANK(A{next_row}), "", SUMIF(\'交易紀錄\'!B:B, A{next_row}, \'交易紀錄\'!G:G))',  # Column D: 總持有股數
-                f'=IF(ISBLANK(A{next_row}), "", GOOGLEFINANCE("TPE:" & A{next_row}, "price"))',          # Column E: 目前股價
-                f'=IF(ISBLANK(A{next_row}), "", D{next_row}*E{next_row})',                               # Column F: 目前總市值
-                f'=IF(ISBLANK(A{next_row}), "", F{next_row}-C{next_row})',                               # Column G: 未實現損益
-                f'=IF(ISBLANK(A{next_row}), "", G{next_row}/C{next_row})'                                # Column H: 報酬率
-            ]]
-            
-            success = append_to_sheet(sheet_id, '總覽與損益', holdings_values)
-            
-        return success
+            rows_by_worksheet['總覽與損益'] = [build_holdings_row(stock_code, stock_name)]
+        
+        # 單一 batchUpdate,不會留下只寫入一半的交易
+        return batch_append_to_sheets(sheet_id, rows_by_worksheet)
         
     except Exception as e:
         st.error(f"處理交易記錄時發生錯誤: {e}")
         return False
 
 # 新增:交易表單渲染函數
-def render_trading_form_for_person(person):
+def select_stock_suggestion():
+    """選擇自動完成建議後帶入股票代號"""
+    choice = st.session_state.get('stock_code_suggestion')
+    if choice:
+        stock_code = choice.split(' ')[0]
+        st.session_state.stock_code_input = stock_code
+        st.session_state.trading_form_data['stock_code'] = stock_code
+
+def render_trading_form_for_person(person, holdings_df=None):
     """渲染交易記錄輸入表單"""
     st.markdown('<div class="trading-form-container">', unsafe_allow_html=True)
     st.markdown('<div class="trading-form-title">📝 新增交易記錄</div>', unsafe_allow_html=True)
@@ -521,13 +1089,28 @@ def render_trading_form_for_person(person):
         )
     
     with col4:
+        if 'stock_code_input' not in st.session_state:
+            st.session_state.stock_code_input = st.session_state.trading_form_data['stock_code']
         stock_code = st.text_input(
             "股票代號",
-            placeholder="例如: 2330",
-            key="stock_code_input",
-            value=st.session_state.trading_form_data['stock_code']
+            placeholder="例如: 2330 或 台積",
+            key="stock_code_input"
         )
         st.session_state.trading_form_data['stock_code'] = stock_code
+        
+        # 自動完成 - 以離線代號表與目前持股做前綴查詢
+        holding_codes = []
+        if holdings_df is not None and '股票代號' in holdings_df.columns:
+            holding_codes = holdings_df['股票代號'].astype(str).str.strip().tolist()
+        suggestions = search_stock_codes(stock_code, holding_codes)
+        if suggestions and stock_code.strip() not in [code for code, _ in suggestions[:1]]:
+            st.selectbox(
+                "建議",
+                options=[''] + [f"{code} {name}" for code, name in suggestions],
+                key="stock_code_suggestion",
+                on_change=select_stock_suggestion,
+                label_visibility="collapsed"
+            )
     
     with col5:
         stock_price = st.number_input(
@@ -599,9 +1182,20 @@ def render_trading_form_for_person(person):
                     )
                 
                 if success:
-                    st.success("✅ 交易記錄已成功新增!")
+                    st.toast("✅ 交易記錄已成功新增!")
                     if holding_type == "新持有" and transaction_type == "買進":
-                        st.success(f"✅ 股票 {stock_code} 已新增至持股清單!")
+                        st.toast(f"✅ 股票 {stock_code} 已新增至持股清單!")
+                    
+                    # 直接更新畫面上的持股,背景再與試算表同步
+                    record_pending_trade(person, {
+                        'stock_code': stock_code.strip(),
+                        'stock_name': get_stock_name(stock_code.strip()) if holding_type == "新持有" else '',
+                        'stock_price': stock_price,
+                        'total_amount': total_amount,
+                        'final_quantity': final_quantity,
+                        'transaction_date': transaction_date,
+                        'new_holding': holding_type == "新持有" and transaction_type == "買進"
+                    })
                     
                     # 重置表單數據
                     st.session_state.trading_form_data = {
@@ -611,146 +1205,1050 @@ def render_trading_form_for_person(person):
                         'stock_price': 100.0,
                         'stock_quantity': 1000
                     }
+                    st.session_state.pop('stock_code_input', None)
                     
-                    # 清除快取並重新載入
-                    time.sleep(1)
-                    st.cache_data.clear()
                     st.rerun()
                 else:
                     st.error("❌ 交易記錄新增失敗,請檢查網路連線或權限設定。")
     
     st.markdown('</div>', unsafe_allow_html=True)
 
-# 優化4: 延長數據快取時間到30分鐘
-@st.cache_data(ttl=1800)
-def load_sheet_data(person, data_type, broker=None):
-    """從Google Sheets載入數據 - 延長快取時間"""
-    service = get_google_sheets_service()
-    if not service:
-        return pd.DataFrame()
+# 新增:券商CSV批次匯入
+# 各欄位可接受的CSV欄位名稱
+BULK_IMPORT_COLUMN_ALIASES = {
+    'date': ['交易日期', '成交日期', '日期', 'date', 'trade date'],
+    'code': ['股票代號', '證券代號', '代號', 'code', 'symbol', 'ticker'],
+    'price': ['成交價', '成交價格', '股價', '價格', 'price'],
+    'quantity': ['股數', '成交股數', '數量', 'quantity', 'shares'],
+    'side': ['買賣', '買賣別', '交易類型', 'side', 'action']
+}
+BUY_SIDE_VALUES = ['買', '買進', '現買', 'buy', 'b']
+SELL_SIDE_VALUES = ['賣', '賣出', '現賣', 'sell', 's']
+
+def read_broker_csv(uploaded_file):
+    """讀取券商匯出的CSV,支援 UTF-8 與 Big5 編碼"""
+    raw = uploaded_file.getvalue()
+    for encoding in ['utf-8-sig', 'big5']:
+        try:
+            return pd.read_csv(io.BytesIO(raw), dtype=str, encoding=encoding, skipinitialspace=True)
+        except UnicodeDecodeError:
+            continue
+    raise ValueError("無法辨識CSV編碼,請使用 UTF-8 或 Big5")
+
+def parse_trade_dates(values):
+    """解析交易日期 - 支援民國年(113/01/03、1130103)與各種西元格式,同一欄可混用不同格式"""
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values
+    text = values.fillna('').astype(str).str.strip()
+    roc = text.str.extract(r'^(\d{2,3})[/\-.](\d{1,2})[/\-.](\d{1,2})$')
+    roc = roc.fillna(text.str.extract(r'^(\d{3})(\d{2})(\d{2})$'))
+    roc_dates = pd.to_datetime(pd.DataFrame({
+        'year': pd.to_numeric(roc[0], errors='coerce') + 1911,
+        'month': pd.to_numeric(roc[1], errors='coerce'),
+        'day': pd.to_numeric(roc[2], errors='coerce')
+    }), errors='coerce')
+    other_dates = pd.to_datetime(text.where(roc[0].isna() & (text != '')), errors='coerce', format='mixed')
+    return roc_dates.fillna(other_dates)
+
+def drop_existing_trades(trades, records_df):
+    """移除交易紀錄中已存在的交易(日期、代號、股價、股數相同),同一天相同的多筆成交依筆數比對"""
+    if trades.empty or records_df.empty or len(records_df.columns) < 7:
+        return trades, 0
+    
+    existing = pd.DataFrame({
+        'date': parse_trade_dates(records_df.iloc[:, 0]).dt.normalize(),
+        'code': records_df.iloc[:, 1].astype(str).str.strip().str.replace(r'\.0$', '', regex=True),
+        'price': parse_number_series(records_df.iloc[:, 2]).round(4),
+        'quantity': parse_number_series(records_df.iloc[:, 6]).round(4)
+    })
+    key_columns = ['date', 'code', 'price', 'quantity']
+    existing_counts = existing.groupby(key_columns).size().rename('existing_count')
+    keys = pd.DataFrame({
+        'date': trades['date'].dt.normalize(),
+        'code': trades['code'],
+        'price': trades['price'].round(4),
+        'quantity': trades['quantity'].round(4)
+    })
+    occurrence = keys.groupby(key_columns).cumcount()
+    existing_count = keys.join(existing_counts, on=key_columns)['existing_count'].fillna(0)
+    duplicate = occurrence < existing_count
+    return trades[~duplicate.to_numpy()], int(duplicate.sum())
+
+def parse_broker_trades(csv_df):
+    """以向量化方式驗證並轉換券商CSV,回傳 (有效交易, 錯誤訊息列表)"""
+    columns = {}
+    normalized_headers = {str(col).strip().lower(): col for col in csv_df.columns}
+    for field, aliases in BULK_IMPORT_COLUMN_ALIASES.items():
+        for alias in aliases:
+            if alias.lower() in normalized_headers:
+                columns[field] = normalized_headers[alias.lower()]
+                break
     
-    try:
-        if person == 'ed_overseas':
-            config = SHEET_CONFIGS[person][broker]
-            sheet_id = config['id']
-            range_name = config['range']
-        else:
-            config = SHEET_CONFIGS[person]
-            sheet_id = config['id']
-            
-            if data_type == 'holdings':
-                range_name = config['holdings_range']
-            elif data_type == 'dca':
-                range_name = config.get('dca_range')
-            elif data_type == 'trend':
-                range_name = config.get('trend_range')
-            else:
-                return pd.DataFrame()
-        
-        if not range_name:
-            return pd.DataFrame()
+    missing = [field for field in ['date', 'code', 'price', 'quantity'] if field not in columns]
+    if missing:
+        return pd.DataFrame(), [f"找不到必要欄位: {', '.join(missing)}"]
+    
+    trades = pd.DataFrame({
+        'date': parse_trade_dates(csv_df[columns['date']]),
+        'code': csv_df[columns['code']].fillna('').astype(str).str.strip(),
+        'price': pd.to_numeric(csv_df[columns['price']].astype(str).str.replace(r'[,%"$]', '', regex=True).str.strip(), errors='coerce')
+    })
+    quantity = pd.to_numeric(csv_df[columns['quantity']].astype(str).str.replace(r'[,"]', '', regex=True).str.strip(), errors='coerce')
+    
+    # 有買賣欄位時依買賣別決定正負號,否則沿用股數本身的正負號
+    if 'side' in columns:
+        side = csv_df[columns['side']].fillna('').astype(str).str.strip().str.lower()
+        sign = pd.Series(np.select([side.isin(BUY_SIDE_VALUES), side.isin(SELL_SIDE_VALUES)], [1, -1], 0), index=csv_df.index)
+        trades['quantity'] = quantity.abs() * sign
+    else:
+        sign = np.sign(quantity).fillna(0)
+        trades['quantity'] = quantity
+    
+    checks = {
+        '日期格式錯誤': trades['date'].isna(),
+        '缺少股票代號': trades['code'] == '',
+        '股價必須大於零': ~(trades['price'] > 0),
+        '股數必須為非零數字': ~(quantity.abs() > 0),
+        '無法辨識買賣別': sign == 0
+    }
+    invalid = pd.Series(False, index=trades.index)
+    errors = []
+    for message, mask in checks.items():
+        mask = mask.fillna(True)
+        invalid |= mask
+        if mask.any():
+            # +2: CSV 第1列為標題
+            rows = ', '.join(str(i + 2) for i in mask[mask].index[:10])
+            errors.append(f"{message} (第 {rows} 列{' 等' if mask.sum() > 10 else ''})")
+    
+    trades = trades[~invalid].copy()
+    trades['amount'] = trades['price'] * trades['quantity']
+    return trades.sort_values('date', kind='stable'), errors
+
+def import_broker_trades(person, trades, holdings_df):
+    """將驗證過的交易一次寫入交易紀錄,新持股一併寫入總覽與損益"""
+    sheet_id = SHEET_CONFIGS[person]['id']
+    
+    trading_rows = [
+        [trade_date, to_entered_stock_code(code), price, '', '', amount, quantity]
+        for trade_date, code, price, amount, quantity in zip(
+            trades['date'].dt.date, trades['code'], trades['price'], trades['amount'], trades['quantity']
+        )
+    ]
+    rows_by_worksheet = {'交易紀錄': trading_rows}
+    
+    # 目前持股中沒有且淨股數為正的代號視為新持股
+    existing_codes = set(holdings_df['股票代號'].astype(str).str.strip()) if '股票代號' in holdings_df.columns else set()
+    net_quantity = trades.groupby('code', sort=False)['quantity'].sum()
+    new_codes = [code for code in net_quantity[net_quantity > 0].index if code not in existing_codes]
+    if new_codes:
+        rows_by_worksheet['總覽與損益'] = [build_holdings_row(code, get_stock_name(code)) for code in new_codes]
+    
+    return batch_append_to_sheets(sheet_id, rows_by_worksheet), new_codes
+
+def render_bulk_import_for_person(person, holdings_df, records_df=None):
+    """渲染券商CSV批次匯入區塊"""
+    with st.expander("📥 批次匯入交易 (券商CSV)"):
+        st.caption("CSV 需包含 交易日期、股票代號、成交價、股數 欄位,可選 買賣別;未提供買賣別時以股數正負號判斷。日期可使用民國年(113/01/03)。")
+        # 匯入成功後更換 key 以清除已上傳的檔案
+        upload_round = st.session_state.setdefault('bulk_import_round', {}).get(person, 0)
+        uploaded_file = st.file_uploader("選擇CSV檔案", type=['csv'], key=f"bulk_import_{person}_{upload_round}")
+        if uploaded_file is None:
+            return
         
-        result = service.spreadsheets().values().get(
-            spreadsheetId=sheet_id,
-            range=range_name
-        ).execute()
+        try:
+            trades, errors = parse_broker_trades(read_broker_csv(uploaded_file))
+        except Exception as e:
+            st.error(f"CSV 解析失敗: {e}")
+            return
         
-        values = result.get('values', [])
-        if not values or len(values) < 2:
-            return pd.DataFrame()
+        trades, duplicate_count = drop_existing_trades(trades, records_df if records_df is not None else pd.DataFrame())
+        if duplicate_count:
+            errors.append(f"已略過 {duplicate_count:,} 筆交易紀錄中已存在的交易")
         
-        # 簡化數據處理邏輯
-        max_cols = len(values[0]) if values else 0
-        normalized_values = [row + [''] * (max_cols - len(row)) for row in values]
+        for error in errors:
+            st.warning(error)
+        if trades.empty:
+            st.info("沒有可匯入的交易。")
+            return
         
-        df = pd.DataFrame(normalized_values[1:], columns=normalized_values[0])
-        df = df.dropna(how='all')
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.info(f"**有效交易:** {len(trades):,} 筆")
+        with col2:
+            st.info(f"**淨投入金額:** {format_currency(trades['amount'].sum())}")
+        with col3:
+            st.info(f"**股票檔數:** {trades['code'].nunique():,}")
+        st.dataframe(trades, use_container_width=True)
         
-        # 簡化數字欄位處理
-        if person == 'ed_overseas':
-            numeric_columns = [col for col in df.columns if any(keyword in col for keyword in ['價', '成本', '市值', '損益', '股數', '率'])]
-        elif data_type == 'holdings':
-            numeric_columns = ['總投入成本', '總持有股數', '目前股價', '目前總市值', '未實現損益', '報酬率']
-        elif data_type == 'dca':
-            numeric_columns = ['每月投入金額', '扣款日', '券商折扣']
-        elif data_type == 'trend':
-            numeric_columns = ['總市值']
+        if st.button(f"✅ 匯入 {len(trades):,} 筆交易", type="primary", key=f"submit_bulk_import_{person}"):
+            with st.spinner('正在匯入交易記錄...'):
+                success, new_codes = import_broker_trades(person, trades, holdings_df)
+            
+            if success:
+                st.toast(f"✅ 已匯入 {len(trades):,} 筆交易記錄!")
+                if new_codes:
+                    st.toast(f"✅ 已新增 {len(new_codes)} 檔持股: {', '.join(new_codes)}")
+                invalidate_worksheets(SHEET_CONFIGS[person]['id'], ['交易紀錄', '總覽與損益'])
+                st.session_state['bulk_import_round'][person] = upload_round + 1
+                st.rerun()
+            else:
+                st.error("❌ 批次匯入失敗,請檢查網路連線或權限設定。")
+
+# 各資料類型對應 SHEET_CONFIGS 中的範圍設定鍵
+SHEET_RANGE_KEYS = {
+    'holdings': 'holdings_range',
+    'dca': 'dca_range',
+    'trend': 'trend_range',
+    'trading_records': 'trading_records_range'
+}
+
+def get_person_sources(person):
+    """列出單一用戶需載入的所有範圍 (資料鍵, 試算表ID, 範圍, 用戶, 資料類型, 券商)"""
+    if person == 'ed_overseas':
+        sources = []
+        for broker, config in SHEET_CONFIGS[person].items():
+            sources.append((broker, config['id'], config['range'], person, None, broker))
+            if config.get('dca_range'):
+                sources.append((f'{broker}_dca', config['id'], config['dca_range'], person, 'dca', broker))
+        return sources
+    
+    config = SHEET_CONFIGS[person]
+    return [
+        (data_type, config['id'], config[range_key], person, data_type, None)
+        for data_type, range_key in SHEET_RANGE_KEYS.items()
+        if config.get(range_key)
+    ]
+
+def get_numeric_columns(columns, person, data_type):
+    """依用戶與資料類型決定需轉換為數字的欄位"""
+    if person == 'ed_overseas' and data_type == 'dca':
+        # 國泰證券定期定額設定 - 使用更靈活的欄位匹配
+        return [col for col in columns if any(keyword in col for keyword in ['金額', '扣款', '折扣', '價'])]
+    elif person == 'ed_overseas':
+        return [col for col in columns if any(keyword in col for keyword in ['價', '成本', '市值', '損益', '股數', '率'])]
+    elif data_type == 'holdings':
+        return ['總投入成本', '總持有股數', '目前股價', '目前總市值', '未實現損益', '報酬率']
+    elif data_type == 'dca':
+        return ['每月投入金額', '扣款日', '券商折扣']
+    elif data_type == 'trend':
+        return ['總市值']
+    return []
+
+def parse_sheet_dates(series):
+    """將日期欄轉為 datetime64 - SERIAL_NUMBER 日期序號直接換算,同欄中的文字日期另外解析"""
+    serial_mask = typed_numeric_mask(series)
+    serials = pd.to_numeric(series.where(serial_mask), errors='coerce')
+    dates = pd.to_datetime(serials, unit='D', origin=SHEETS_EPOCH)
+    return dates.fillna(parse_trade_dates(series.where(~serial_mask)))
+
+def build_sheet_dataframe(values, person, data_type, broker=None):
+    """將工作表原始數值轉換為DataFrame"""
+    if not values or len(values) < 2:
+        return pd.DataFrame()
+    
+    # 簡化數據處理邏輯
+    max_cols = len(values[0])
+    normalized_values = [row[:max_cols] + [''] * (max_cols - len(row)) for row in values[1:]]
+    
+    df = pd.DataFrame(normalized_values, columns=[str(col) for col in values[0]])
+    df = df.dropna(how='all')
+    
+    formats = SHEET_COLUMN_FORMATS.get(data_type or broker, {})
+    percent_columns = {df.columns[i] for i in formats.get('percent', []) if i < len(df.columns)}
+    date_columns = {df.columns[i] for i in formats.get('date', []) if i < len(df.columns)}
+    
+    numeric_columns = [col for col in get_numeric_columns(df.columns, person, data_type) if col in df.columns]
+    for col in numeric_columns:
+        typed_mask = typed_numeric_mask(df[col])
+        parsed = parse_number_series(df[col])
+        if col in percent_columns:
+            # 數字格為小數(0.1234),文字格(例如 "12.34%")已是百分比,只轉換數字格
+            parsed = parsed.where(~typed_mask, parsed * 100)
+        df[col] = parsed
+    
+    for col in df.columns.unique():
+        if col in numeric_columns or not isinstance(df[col], pd.Series):
+            continue
+        if col in date_columns:
+            df[col] = parse_sheet_dates(df[col])
+        elif pd.api.types.infer_dtype(df[col], skipna=True) != 'string':
+            # 文字欄位中混入的數字(例如股票代號 2330)統一轉為字串
+            df[col] = df[col].astype(str)
+    
+    return df
+
+def request_workbook_values(service, sheet_id, range_names):
+    """以單一 values().batchGet 取得同一試算表的多個範圍"""
+    result = service.spreadsheets().values().batchGet(
+        spreadsheetId=sheet_id,
+        ranges=list(range_names),
+        **(FORMATTED_VALUE_RENDER_OPTIONS if sheet_id in FORMATTED_VALUE_SHEET_IDS else SHEET_VALUE_RENDER_OPTIONS)
+    ).execute()
+    
+    # valueRanges 依請求順序回傳,回傳的範圍名稱會被正規化,因此以順序對應
+    value_ranges = result.get('valueRanges', [])
+    return {
+        range_name: value_range.get('values', [])
+        for range_name, value_range in zip(range_names, value_ranges)
+    }
+
+# 新增:只增不改的工作表以快照為基礎,只下載新增的列
+def get_tail_ranges(range_name, row_count):
+    """快照已有 row_count 列時的檢查範圍(標題列、最後一列)與新列範圍,無法拆解的範圍回傳 None"""
+    match = re.fullmatch(r'(.+)!([A-Z]+):([A-Z]+)', range_name)
+    if not match or row_count == 0:
+        return None
+    worksheet, first_col, last_col = match.groups()
+    return {
+        'header': f'{worksheet}!{first_col}1:{last_col}1',
+        'anchor': f'{worksheet}!{first_col}{row_count}:{last_col}{row_count}',
+        'tail': f'{worksheet}!{first_col}{row_count + 1}:{last_col}'
+    }
+
+@st.cache_resource
+def get_full_reload_state():
+    """只增不改的範圍最近一次整段載入時的時間窗(整個程序共用)"""
+    return {'lock': threading.Lock(), 'windows': {}}
+
+def get_full_reload_window(range_name):
+    """整段重新載入的時間窗 - 交易時段內最多每 CLOSED_MARKET_MAX_TTL_SECONDS 一次,每次收盤後至少一次"""
+    markets = SOURCE_MARKETS.get(get_worksheet_name(range_name), ['TWSE'])
+    return get_cache_window(markets, CLOSED_MARKET_MAX_TTL_SECONDS)[0]
+
+def needs_full_reload(sheet_id, range_name):
+    """本時間窗內尚未整段載入過,需整段載入以發現較早的列被修改"""
+    state = get_full_reload_state()
+    with state['lock']:
+        return state['windows'].get((sheet_id, range_name)) != get_full_reload_window(range_name)
+
+def mark_full_reload(sheet_id, range_names):
+    """記錄範圍已在本時間窗內整段載入"""
+    state = get_full_reload_state()
+    with state['lock']:
+        for range_name in range_names:
+            state['windows'][(sheet_id, range_name)] = get_full_reload_window(range_name)
+
+def ledger_matches_holdings(ledger_rows, holdings_rows):
+    """比對持股的 SUMIF 欄位(C欄總投入成本、D欄總持有股數)與交易紀錄的加總,不一致表示較早的交易被修改"""
+    positions = compute_positions(pd.DataFrame(ledger_rows[1:]))
+    holdings = pd.DataFrame(holdings_rows[1:])
+    if positions.empty or holdings.empty or len(holdings.columns) < 4:
+        return True
+    
+    holdings = pd.DataFrame({
+        '股票代號': holdings.iloc[:, 0].astype(str).str.strip(),
+        '總投入成本': parse_number_series(holdings.iloc[:, 2]),
+        '總持有股數': parse_number_series(holdings.iloc[:, 3])
+    })
+    # 只比對交易紀錄中有的代號,尚未加入持股或手動輸入的列不影響
+    holdings = holdings[holdings['股票代號'].isin(positions.index)].drop_duplicates('股票代號').set_index('股票代號')
+    expected = positions.loc[holdings.index, ['總投入成本', '總持有股數']]
+    return bool(np.allclose(holdings.to_numpy(), expected.to_numpy(), rtol=1e-9, atol=1e-6))
+
+def request_appended_values(service, sheet_id, range_names, snapshots):
+    """重新取得多個範圍 - 只增不改的工作表在同一次 batchGet 中只下載快照之後的列,標題或最後一列改變時整段重新載入"""
+    tail_plans = {}
+    requested = []
+    for range_name in range_names:
+        rows = snapshots.get(range_name, ([], 0))[0]
+        # 只比對標題與最後一列無法發現較早的列被修改,因此每個時間窗仍整段載入一次
+        use_tail = get_worksheet_name(range_name) in APPEND_ONLY_WORKSHEETS and not needs_full_reload(sheet_id, range_name)
+        tail_ranges = get_tail_ranges(range_name, len(rows)) if use_tail else None
+        if tail_ranges:
+            tail_plans[range_name] = tail_ranges
+            requested.extend(tail_ranges.values())
         else:
-            numeric_columns = []
-        
-        for col in numeric_columns:
-            if col in df.columns:
-                df[col] = df[col].apply(parse_number)
-        
-        return df
+            requested.append(range_name)
+    
+    fetched = request_workbook_values(service, sheet_id, requested)
+    values_by_range = {}
+    full_reload = []
+    for range_name in range_names:
+        tail_ranges = tail_plans.get(range_name)
+        if tail_ranges is None:
+            values_by_range[range_name] = fetched[range_name]
+            continue
+        
+        rows = snapshots[range_name][0]
+        if fetched[tail_ranges['header']][:1] == rows[:1] and fetched[tail_ranges['anchor']][:1] == rows[-1:]:
+            values_by_range[range_name] = rows + fetched[tail_ranges['tail']]
+        else:
+            # 既有的列被修改、插入或刪除
+            full_reload.append(range_name)
+    
+    # 較早的交易被修改時標題與最後一列不變,改以同一次 batchGet 取得的持股 SUMIF 欄位檢查交易紀錄
+    holdings_range = next((range_name for range_name in range_names if get_worksheet_name(range_name) == '總覽與損益'), None)
+    if holdings_range is not None:
+        for range_name in tail_plans:
+            if (get_worksheet_name(range_name) == '交易紀錄' and range_name not in full_reload
+                    and not ledger_matches_holdings(values_by_range[range_name], values_by_range[holdings_range])):
+                full_reload.append(range_name)
+    
+    if full_reload:
+        values_by_range.update(request_workbook_values(service, sheet_id, full_reload))
+    mark_full_reload(sheet_id, [
+        range_name for range_name in range_names
+        if get_worksheet_name(range_name) in APPEND_ONLY_WORKSHEETS and (range_name not in tail_plans or range_name in full_reload)
+    ])
+    return values_by_range
+
+# 新增:本地快照存取
+def open_snapshot_db():
+    """開啟本地快照資料庫"""
+    snapshot_dir = os.path.dirname(SNAPSHOT_DB_PATH)
+    if snapshot_dir:
+        os.makedirs(snapshot_dir, exist_ok=True)
+    
+    conn = sqlite3.connect(SNAPSHOT_DB_PATH, timeout=10)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS sheet_snapshots (
+            sheet_id TEXT NOT NULL,
+            range_name TEXT NOT NULL,
+            values_json TEXT NOT NULL,
+            fetched_at REAL NOT NULL,
+            PRIMARY KEY (sheet_id, range_name)
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS fx_rates (
+            pair TEXT PRIMARY KEY,
+            rate REAL NOT NULL,
+            fetched_at REAL NOT NULL
+        )
+    """)
+    return conn
+
+def read_snapshots(sheet_id, range_names):
+    """讀取快照,回傳 {範圍: (數值, 取得時間)}"""
+    try:
+        conn = open_snapshot_db()
+        try:
+            placeholders = ','.join('?' * len(range_names))
+            rows = conn.execute(
+                f'SELECT range_name, values_json, fetched_at FROM sheet_snapshots '
+                f'WHERE sheet_id = ? AND range_name IN ({placeholders})',
+                [sheet_id, *range_names]
+            ).fetchall()
+        finally:
+            conn.close()
+        return {range_name: (json.loads(values_json), fetched_at) for range_name, values_json, fetched_at in rows}
+    except (sqlite3.Error, OSError, ValueError):
+        # 快照僅作為加速用途,讀取失敗時改由網路載入
+        return {}
+
+def write_snapshots(sheet_id, values_by_range, fetched_at=None):
+    """寫入快照 - fetched_at 為請求發出的時間,較晚發出的請求先完成時不會被較舊的結果覆蓋"""
+    fetched_at = fetched_at or time.time()
+    try:
+        conn = open_snapshot_db()
+        try:
+            with conn:
+                # 失效的快照以負的失效時間標記,只有在失效之後才發出的請求能取代它
+                conn.executemany(
+                    'INSERT INTO sheet_snapshots (sheet_id, range_name, values_json, fetched_at) VALUES (?, ?, ?, ?) '
+                    'ON CONFLICT (sheet_id, range_name) DO UPDATE SET values_json = excluded.values_json, fetched_at = excluded.fetched_at '
+                    'WHERE excluded.fetched_at > abs(sheet_snapshots.fetched_at)',
+                    [(sheet_id, range_name, json.dumps(values, ensure_ascii=False), fetched_at)
+                     for range_name, values in values_by_range.items()]
+                )
+        finally:
+            conn.close()
+    except (sqlite3.Error, OSError):
+        pass
+
+def read_last_known_rate(pair):
+    """讀取本地保存的最後一次成功匯率"""
+    try:
+        conn = open_snapshot_db()
+        try:
+            row = conn.execute('SELECT rate FROM fx_rates WHERE pair = ?', (pair,)).fetchone()
+        finally:
+            conn.close()
+        return row[0] if row else None
+    except (sqlite3.Error, OSError):
+        return None
+
+def write_last_known_rate(pair, rate):
+    """保存成功取得的匯率"""
+    try:
+        conn = open_snapshot_db()
+        try:
+            with conn:
+                conn.execute(
+                    'INSERT OR REPLACE INTO fx_rates (pair, rate, fetched_at) VALUES (?, ?, ?)',
+                    (pair, rate, time.time())
+                )
+        finally:
+            conn.close()
+    except (sqlite3.Error, OSError):
+        pass
+
+def get_worksheet_name(range_name):
+    """從範圍字串取得工作表名稱,例如 '總覽與損益!A:I' -> '總覽與損益'"""
+    return range_name.split('!')[0].strip("'")
+
+def select_snapshot_ranges(conn, sheet_id, worksheets):
+    """找出屬於指定工作表的快照範圍"""
+    return [
+        row[0] for row in conn.execute('SELECT range_name FROM sheet_snapshots WHERE sheet_id = ?', (sheet_id,))
+        if get_worksheet_name(row[0]) in worksheets
+    ]
+
+def clear_snapshots(sheet_id, worksheets):
+    """清除指定工作表的快照內容並標記失效時間,強制下次由網路整段重新載入"""
+    try:
+        conn = open_snapshot_db()
+        try:
+            with conn:
+                conn.executemany(
+                    "UPDATE sheet_snapshots SET values_json = '[]', fetched_at = ? WHERE sheet_id = ? AND range_name = ?",
+                    [(-time.time(), sheet_id, range_name) for range_name in select_snapshot_ranges(conn, sheet_id, worksheets)]
+                )
+        finally:
+            conn.close()
+    except (sqlite3.Error, OSError):
+        pass
+
+def expire_snapshots(sheet_id, worksheets):
+    """將快照標記為已失效但保留內容,下次載入時同步取得快照之後新增的列"""
+    try:
+        conn = open_snapshot_db()
+        try:
+            with conn:
+                conn.executemany(
+                    'UPDATE sheet_snapshots SET fetched_at = ? WHERE sheet_id = ? AND range_name = ?',
+                    [(-time.time(), sheet_id, range_name) for range_name in select_snapshot_ranges(conn, sheet_id, worksheets)]
+                )
+        finally:
+            conn.close()
+    except (sqlite3.Error, OSError):
+        pass
+
+# 優化20: 欄式歷史資料存取 - 唯讀 memmap 切片不複製資料,新交易日直接附加在檔尾
+@st.cache_resource
+def get_column_store_locks():
+    """各欄式資料庫的寫入鎖(整個程序共用)"""
+    return {'lock': threading.Lock(), 'locks': {}}
+
+def get_column_store_lock(name):
+    """取得單一欄式資料庫的寫入鎖"""
+    state = get_column_store_locks()
+    with state['lock']:
+        return state['locks'].setdefault(name, threading.Lock())
+
+def get_column_store_path(name, filename=''):
+    """欄式資料庫目錄或其中的檔案路徑"""
+    return os.path.join(COLUMN_STORE_DIR, name, filename)
+
+def map_column_file(path, dtype, length, mode='r'):
+    """以 memmap 對應欄位檔的前 length 筆"""
+    if length == 0:
+        return np.empty(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode=mode, shape=(length,))
+
+def load_column_store(name, columns=None):
+    """回傳 (日期陣列, {欄名: 唯讀 memmap}),所有陣列長度相同且不複製資料"""
+    dates_path = get_column_store_path(name, COLUMN_STORE_DATES_FILE)
+    if not os.path.exists(dates_path):
+        return np.empty(0, dtype='datetime64[D]'), {}
+    
+    # 日期檔最後寫入,其長度即為已完成附加的列數,欄位檔多出的尾端會被忽略
+    length = os.path.getsize(dates_path) // 8
+    dates = map_column_file(dates_path, '<i8', length).view('datetime64[D]')
+    available = {
+        filename[:-len(COLUMN_STORE_SUFFIX)] for filename in os.listdir(get_column_store_path(name))
+        if filename.endswith(COLUMN_STORE_SUFFIX)
+    }
+    arrays = {}
+    for column in (columns if columns is not None else sorted(available)):
+        column_path = get_column_store_path(name, f'{column}{COLUMN_STORE_SUFFIX}')
+        if column in available and os.path.getsize(column_path) >= length * 8:
+            arrays[column] = map_column_file(column_path, '<f8', length)
+    return dates, arrays
+
+def read_column_store(name, columns=None, start=None):
+    """讀取欄式資料庫為 DataFrame(列為日期,欄為代號),可指定起始日期"""
+    dates, arrays = load_column_store(name, columns)
+    first = int(dates.searchsorted(np.datetime64(start, 'D'))) if start is not None else 0
+    frame = pd.DataFrame(
+        {column: np.asarray(array[first:]) for column, array in arrays.items()},
+        index=pd.DatetimeIndex(dates[first:].astype('datetime64[ns]'), name='date')
+    )
+    return frame.reindex(columns=list(columns)) if columns is not None else frame
+
+def write_column_store(name, frame):
+    """整個重寫欄式資料庫(僅在需要插入既有日期之前的資料時使用)"""
+    os.makedirs(get_column_store_path(name), exist_ok=True)
+    for column in frame.columns:
+        column_path = get_column_store_path(name, f'{column}{COLUMN_STORE_SUFFIX}')
+        frame[column].to_numpy(dtype='<f8').tofile(column_path + '.tmp')
+        os.replace(column_path + '.tmp', column_path)
+    dates_path = get_column_store_path(name, COLUMN_STORE_DATES_FILE)
+    frame.index.values.astype('datetime64[D]').astype('<i8').tofile(dates_path + '.tmp')
+    os.replace(dates_path + '.tmp', dates_path)
+
+def append_column_store(name, frame):
+    """合併每日資料:已存在的日期就地更新,較新的交易日附加在檔尾,新代號以 NaN 補齊既有日期"""
+    frame = frame.copy()
+    frame.index = pd.DatetimeIndex(frame.index).tz_localize(None).normalize()
+    frame = frame[~frame.index.duplicated(keep='last')].sort_index().astype('float64')
+    frame.columns = [str(column) for column in frame.columns]
+    if frame.empty:
+        return
+    
+    with get_column_store_lock(name):
+        dates, arrays = load_column_store(name)
+        frame_dates = frame.index.values.astype('datetime64[D]')
+        overlap = frame_dates <= dates[-1] if len(dates) else np.zeros(len(frame_dates), dtype=bool)
+        positions = dates.searchsorted(frame_dates[overlap])
+        if len(dates) == 0 or frame_dates[0] < dates[0] or not np.array_equal(dates[np.minimum(positions, len(dates) - 1)], frame_dates[overlap]):
+            # 需要插入既有範圍內缺少的日期,改為整個重寫
+            existing = read_column_store(name)
+            write_column_store(name, frame.combine_first(existing) if not existing.empty else frame)
+            return
         
+        length = len(dates)
+        del dates, arrays
+        for column in frame.columns:
+            column_path = get_column_store_path(name, f'{column}{COLUMN_STORE_SUFFIX}')
+            if not os.path.exists(column_path):
+                np.full(length, np.nan, dtype='<f8').tofile(column_path)
+            
+            # 既有日期就地更新,新值為 NaN 時保留原值
+            values = frame[column].to_numpy()[overlap]
+            if len(values):
+                stored = map_column_file(column_path, '<f8', length, mode='r+')
+                stored[positions] = np.where(np.isnan(values), stored[positions], values)
+                stored.flush()
+                del stored
+        
+        new_rows = frame.loc[~overlap]
+        if new_rows.empty:
+            return
+        for filename in os.listdir(get_column_store_path(name)):
+            if not filename.endswith(COLUMN_STORE_SUFFIX):
+                continue
+            column = filename[:-len(COLUMN_STORE_SUFFIX)]
+            values = new_rows[column].to_numpy(dtype='<f8') if column in new_rows.columns else np.full(len(new_rows), np.nan)
+            with open(get_column_store_path(name, filename), 'r+b') as column_file:
+                # 先截掉上次中斷時留下的尾端,再附加新的交易日
+                column_file.truncate(length * 8)
+                column_file.seek(length * 8)
+                column_file.write(values.astype('<f8').tobytes())
+        with open(get_column_store_path(name, COLUMN_STORE_DATES_FILE), 'ab') as dates_file:
+            dates_file.write(new_rows.index.values.astype('datetime64[D]').astype('<i8').tobytes())
+
+@st.cache_resource
+def get_snapshot_refresh_state():
+    """背景更新的共用狀態(整個程序共用)"""
+    return {'lock': threading.Lock(), 'inflight': set()}
+
+def refresh_snapshots_in_background(service, sheet_id, range_names, delay=0, force=False):
+    """在背景重新載入過期的快照,同一範圍同時只會有一個更新(force 時一律重新載入)"""
+    state = get_snapshot_refresh_state()
+    key = (sheet_id, tuple(range_names))
+    with state['lock']:
+        if key in state['inflight'] and not force:
+            return
+        state['inflight'].add(key)
+    
+    def refresh():
+        try:
+            if delay:
+                time.sleep(delay)  # 等待試算表公式重新計算
+            # 只共用在此之後才發出的請求,強制更新(如寫入後同步)不會拿到寫入前的數據
+            started_at = time.time()
+            fetch_and_store_values(service, sheet_id, range_names, not_before=started_at)
+            # 讓下一次重新執行時讀取新的快照,版本更新後才標記同步時間
+            worksheets = {get_worksheet_name(range_name) for range_name in range_names}
+            bump_cache_versions(sheet_id, worksheets)
+            mark_synced(sheet_id, worksheets, started_at)
+        except Exception:
+            pass  # 背景更新失敗時保留舊快照,下次過期時再重試
+        finally:
+            with state['lock']:
+                state['inflight'].discard(key)
+    
+    threading.Thread(target=refresh, daemon=True).start()
+
+# 新增:singleflight - 多個 session 同時需要同一組範圍時只發出一次 Sheets 請求
+@st.cache_resource
+def get_singleflight_state():
+    """進行中的請求與合併統計(整個程序共用)"""
+    return {'lock': threading.Lock(), 'calls': {}, 'fetches': 0, 'coalesced': 0}
+
+@st.cache_resource
+def get_price_flight_state():
+    """進行中的歷史股價下載(整個程序共用,與 Sheets 請求分開統計)"""
+    return {'lock': threading.Lock(), 'calls': {}, 'fetches': 0, 'coalesced': 0}
+
+def singleflight(key, fetch, not_before=None, state=None):
+    """同一 key 同時只執行一次 fetch,其他呼叫者等待並共用結果(含例外)"""
+    # not_before: 只加入在此時間之後才開始的請求,寫入後的更新不會拿到寫入前發出的請求結果
+    state = state or get_singleflight_state()
+    with state['lock']:
+        inflight = state['calls'].get(key)
+        if inflight is not None and (not_before is None or inflight[0] >= not_before):
+            call = inflight[1]
+            state['coalesced'] += 1
+            is_leader = False
+        else:
+            call = Future()
+            inflight = state['calls'][key] = (time.time(), call)
+            state['fetches'] += 1
+            is_leader = True
+    
+    if not is_leader:
+        return call.result()
+    
+    try:
+        call.set_result(fetch())
+    except BaseException as e:
+        # 包含 KeyboardInterrupt 等例外,確保等待中的呼叫者不會永久卡住
+        call.set_exception(e)
+    finally:
+        with state['lock']:
+            if state['calls'].get(key) is inflight:
+                del state['calls'][key]
+    return call.result()
+
+def fetch_and_store_values(service, sheet_id, range_names, not_before=None):
+    """由網路取得最新數值並寫入快照,同時發生的相同請求會合併"""
+    def fetch():
+        started_at = time.time()
+        values_by_range = request_appended_values(service, sheet_id, range_names, read_snapshots(sheet_id, range_names))
+        write_snapshots(sheet_id, values_by_range, fetched_at=started_at)
+        return values_by_range
+    return singleflight((sheet_id, tuple(range_names)), fetch, not_before)
+
+# 優化12: 先讀本地快照,過期時背景更新 (stale-while-revalidate)
+def fetch_workbook_values(sheet_id, range_names, fresh_after=None):
+    """取得同一試算表的多個範圍 - 優先使用本地快照,早於 fresh_after 的快照在背景更新"""
+    service = get_google_sheets_service()
+    if fresh_after is None:
+        fresh_after = time.time() - SHEET_INTRADAY_TTL_SECONDS
+    
+    snapshots = read_snapshots(sheet_id, range_names)
+    # fetched_at 為負值表示寫入後已失效(絕對值為失效時間),需同步重新載入
+    if snapshots and all(range_name in snapshots for range_name in range_names):
+        oldest_fetched_at = min(fetched_at for _, fetched_at in snapshots.values())
+        if oldest_fetched_at > 0:
+            if service and oldest_fetched_at < fresh_after:
+                refresh_snapshots_in_background(service, sheet_id, range_names)
+            return {range_name: snapshots[range_name][0] for range_name in range_names}
+    
+    if not service:
+        return None
+    
+    expired_at = [-fetched_at for _, fetched_at in snapshots.values() if fetched_at <= 0]
+    return fetch_and_store_values(service, sheet_id, range_names, not_before=max(expired_at, default=None))
+
+# 新增:依工作表的快取版本 - 只讓寫入影響到的範圍失效
+@st.cache_resource
+def get_cache_versions():
+    """各 (試算表ID, 工作表) 的快取版本(整個程序共用)"""
+    return {'lock': threading.Lock(), 'versions': {}, 'synced_at': {}}
+
+def get_sources_version(sources):
+    """取得一組範圍的快取版本與交易時段時間窗,作為 load_workbook_frames 的快取鍵"""
+    state = get_cache_versions()
+    with state['lock']:
+        versions = tuple(state['versions'].get((source[1], get_worksheet_name(source[2])), 0) for source in sources)
+    return versions + (get_cache_window(get_sources_markets(sources), SHEET_INTRADAY_TTL_SECONDS)[0],)
+
+def bump_cache_versions(sheet_id, worksheets):
+    """提高工作表的快取版本,下次載入時重新建立DataFrame"""
+    state = get_cache_versions()
+    with state['lock']:
+        for worksheet in worksheets:
+            key = (sheet_id, worksheet)
+            state['versions'][key] = state['versions'].get(key, 0) + 1
+
+def mark_synced(sheet_id, worksheets, started_at):
+    """記錄工作表最近一次完成的背景更新是在何時發出的"""
+    state = get_cache_versions()
+    with state['lock']:
+        for worksheet in worksheets:
+            key = (sheet_id, worksheet)
+            state['synced_at'][key] = max(state['synced_at'].get(key, 0.0), started_at)
+
+def get_synced_at(sheet_id, worksheet):
+    """取得工作表最近一次完成的背景更新的發出時間"""
+    state = get_cache_versions()
+    with state['lock']:
+        return state['synced_at'].get((sheet_id, worksheet), 0.0)
+
+def invalidate_worksheets(sheet_id, worksheets, full_reload=False):
+    """讓寫入影響到的工作表(含公式相依的工作表)失效,其他快取(如匯率)維持不變"""
+    affected = set(worksheets)
+    for worksheet in worksheets:
+        affected.update(WORKSHEET_DEPENDENCIES.get(worksheet, []))
+    
+    # 只增不改的工作表保留快照,下次只下載新增的列;full_reload 時一律整段重新載入
+    append_only = set() if full_reload else affected & APPEND_ONLY_WORKSHEETS
+    expire_snapshots(sheet_id, append_only)
+    clear_snapshots(sheet_id, affected - append_only)
+    bump_cache_versions(sheet_id, affected)
+
+def invalidate_person_data(person):
+    """讓單一用戶所有工作表的快取失效(手動更新,整段重新載入)"""
+    worksheets_by_sheet = {}
+    for source in get_person_sources(person):
+        worksheets_by_sheet.setdefault(source[1], set()).add(get_worksheet_name(source[2]))
+    for sheet_id, worksheets in worksheets_by_sheet.items():
+        invalidate_worksheets(sheet_id, worksheets, full_reload=True)
+
+# 優化21: 內容指紋 - 試算表內容未變時直接沿用上次建立的 DataFrame,不重新解析
+@st.cache_resource
+def get_frame_fingerprints():
+    """各範圍的 (內容雜湊, DataFrame) 與命中統計(整個程序共用)"""
+    return {'lock': threading.Lock(), 'frames': {}, 'hits': 0, 'misses': 0}
+
+def hash_values(values):
+    """計算試算表原始 values 的雜湊值"""
+    return hashlib.sha1(json.dumps(values, ensure_ascii=False, separators=(',', ':')).encode('utf-8')).hexdigest()
+
+def build_sheet_dataframe_cached(sheet_id, range_name, values, person, data_type, broker=None):
+    """內容雜湊與上次相同時回傳上次建立的 DataFrame,否則重新建立"""
+    key = (sheet_id, range_name, person, data_type)
+    content_hash = hash_values(values)
+    state = get_frame_fingerprints()
+    with state['lock']:
+        cached = state['frames'].get(key)
+        if cached is not None and cached[0] == content_hash:
+            state['hits'] += 1
+            return cached[1]
+        state['misses'] += 1
+    
+    df = build_sheet_dataframe(values, person, data_type, broker)
+    with state['lock']:
+        state['frames'][key] = (content_hash, df)
+    return df
+
+# 優化10: 同一試算表的所有範圍合併為一次 batchGet
+@st.cache_data(ttl=CLOSED_MARKET_MAX_TTL_SECONDS)
+def load_workbook_frames(sheet_id, sources, cache_version=None):
+    """批次載入同一試算表的所有範圍並建立DataFrame - 取得失敗時拋出例外,失敗結果不進入快取"""
+    _, window_start = get_cache_window(get_sources_markets(sources), SHEET_INTRADAY_TTL_SECONDS)
+    values_by_range = fetch_workbook_values(sheet_id, [source[2] for source in sources], fresh_after=window_start)
+    if values_by_range is None:
+        raise RuntimeError("無法連接至 Google Sheets 服務")
+    
+    data = {}
+    for key, _, range_name, person, data_type, broker in sources:
+        try:
+            data[key] = build_sheet_dataframe_cached(sheet_id, range_name, values_by_range.get(range_name, []), person, data_type, broker)
+        except Exception as e:
+            st.error(f"載入{person} {broker or data_type}數據失敗: {str(e)}")
+            data[key] = pd.DataFrame()
+    return data
+
+def load_workbook_data(sheet_id, sources, cache_version=None):
+    """批次載入同一試算表的所有範圍,每個試算表只呼叫一次API;失敗時回傳空的DataFrame,下次執行會重試"""
+    try:
+        return load_workbook_frames(sheet_id, sources, cache_version)
     except Exception as e:
-        st.error(f"載入{person} {broker or data_type}數據失敗: {str(e)}")
-        return pd.DataFrame()
+        st.error(f"載入試算表 {sheet_id} 數據失敗: {str(e)}")
+        return {source[0]: pd.DataFrame() for source in sources}
 
 # 優化5: 批次載入相關數據
-@st.cache_data(ttl=1800)
 def load_person_all_data(person):
-    """批次載入單一用戶的所有數據"""
-    if person == 'ed_overseas':
-        return {
-            'schwab': load_sheet_data('ed_overseas', None, 'schwab'),
-            'cathay': load_sheet_data('ed_overseas', None, 'cathay'),
-            'cathay_dca': load_cathay_dca_data(),
-            'fubon_uk': load_sheet_data('ed_overseas', None, 'fubon_uk')
-        }
+    """批次載入單一用戶的所有數據 - 依試算表ID分組,各試算表並行 batchGet"""
+    sources_by_sheet = {}
+    for source in get_person_sources(person):
+        sources_by_sheet.setdefault(source[1], []).append(tuple(source))
+    
+    if len(sources_by_sheet) > 1:
+        results = fan_out({
+            sheet_id: (lambda sheet_id=sheet_id, sources=tuple(sources), version=get_sources_version(sources):
+                       load_workbook_data(sheet_id, sources, version))
+            for sheet_id, sources in sources_by_sheet.items()
+        })
     else:
-        return {
-            'holdings': load_sheet_data(person, 'holdings'),
-            'dca': load_sheet_data(person, 'dca'),
-            'trend': load_sheet_data(person, 'trend')
+        results = {
+            sheet_id: load_workbook_data(sheet_id, tuple(sources), get_sources_version(sources))
+            for sheet_id, sources in sources_by_sheet.items()
         }
+    
+    data = {} if person == 'ed_overseas' else {'holdings': pd.DataFrame(), 'dca': pd.DataFrame(), 'trend': pd.DataFrame()}
+    for sheet_id, sources in sources_by_sheet.items():
+        workbook_data = results.get(sheet_id) or {}
+        for source in sources:
+            data[source[0]] = workbook_data.get(source[0], pd.DataFrame())
+    
+    # 有交易紀錄時,總投入成本與總持有股數改由交易紀錄計算
+    if not data.get('trading_records', pd.DataFrame()).empty:
+        data['holdings'] = derive_holdings(data['holdings'], compute_positions(data['trading_records']))
+    
+    # 台股持股以批次股價服務更新目前股價,不依賴試算表重新計算
+    holdings_df = data.get('holdings', pd.DataFrame())
+    if '股票代號' in holdings_df.columns:
+        prices = get_market_prices(holdings_df['股票代號'].astype(str).str.strip())
+        data['holdings'] = apply_market_prices(holdings_df, prices)
+    return data
 
-@st.cache_data(ttl=1800)
-def load_cathay_dca_data():
-    """載入國泰證券定期定額設定"""
-    service = get_google_sheets_service()
-    if not service:
-        return pd.DataFrame()
+# 優化14: 持股部位引擎 - 讀取交易紀錄一次,以 groupby 取代每列的 SUMIF 公式
+HOLDINGS_METRIC_COLUMNS = ['股票代號', '總投入成本', '總持有股數', '目前股價', '目前總市值', '未實現損益', '報酬率']
+
+def compute_positions(records_df):
+    """依交易紀錄(B欄代號、F欄金額、G欄股數)計算各股票的總投入成本與總持有股數"""
+    if records_df.empty or len(records_df.columns) < 7:
+        return pd.DataFrame(columns=['總投入成本', '總持有股數'])
+    
+    ledger = pd.DataFrame({
+        '股票代號': records_df.iloc[:, 1].astype(str).str.strip(),
+        '總投入成本': parse_number_series(records_df.iloc[:, 5]),
+        '總持有股數': parse_number_series(records_df.iloc[:, 6])
+    })
+    ledger = ledger[ledger['股票代號'] != '']
+    return ledger.groupby('股票代號', sort=False)[['總投入成本', '總持有股數']].sum()
+
+def recalculate_holdings_metrics(holdings_df, mask):
+    """重新計算市值、未實現損益與報酬率,與試算表公式相同"""
+    rows = holdings_df.loc[mask]
+    market_value = rows['總持有股數'] * rows['目前股價']
+    unrealized = market_value - rows['總投入成本']
+    holdings_df.loc[mask, '目前總市值'] = market_value
+    holdings_df.loc[mask, '未實現損益'] = unrealized
+    holdings_df.loc[mask, '報酬率'] = (unrealized / rows['總投入成本'].where(rows['總投入成本'] != 0)).fillna(0.0) * 100
+    return holdings_df
+
+def derive_holdings(holdings_df, positions):
+    """以部位引擎的結果覆蓋持股的成本與股數,並重新計算衍生欄位"""
+    if positions.empty or not all(col in holdings_df.columns for col in HOLDINGS_METRIC_COLUMNS):
+        return holdings_df
+    
+    holdings_df = holdings_df.copy()
+    codes = holdings_df['股票代號'].astype(str).str.strip()
+    mask = codes.isin(positions.index)
+    if not mask.any():
+        return holdings_df
+    
+    holdings_df.loc[mask, '總投入成本'] = codes[mask].map(positions['總投入成本']).values
+    holdings_df.loc[mask, '總持有股數'] = codes[mask].map(positions['總持有股數']).values
+    return recalculate_holdings_metrics(holdings_df, mask)
+
+# 新增:由交易紀錄與每日收盤價回推每日總市值,不需手動輸入資產趨勢
+def get_ledger_quantities(records_df):
+    """整理交易紀錄為 (日期, 股票代號, 股數),無法解析日期或代號的列會被略過"""
+    if records_df.empty or len(records_df.columns) < 7:
+        return pd.DataFrame(columns=['日期', '股票代號', '股數'])
+    
+    ledger = pd.DataFrame({
+        '日期': parse_trade_dates(records_df.iloc[:, 0]),
+        '股票代號': records_df.iloc[:, 1].astype(str).str.strip(),
+        '股數': parse_number_series(records_df.iloc[:, 6])
+    })
+    return ledger[ledger['日期'].notna() & (ledger['股票代號'] != '')]
+
+def reconstruct_nav(ledger, closes):
+    """以每日累計股數乘上每日收盤價矩陣,計算每日總市值"""
+    if ledger.empty or closes.empty:
+        return pd.Series(dtype='float64')
+    
+    dates = closes.index
+    codes = closes.columns
+    # 非交易日的交易歸入下一個交易日,早於第一個交易日的交易自第一日起計入
+    date_idx = dates.searchsorted(ledger['日期'].dt.normalize().to_numpy())
+    code_idx = codes.get_indexer(ledger['股票代號'])
+    keep = (code_idx >= 0) & (date_idx < len(dates))
+    
+    deltas = np.zeros((len(dates), len(codes)))
+    np.add.at(deltas, (date_idx[keep], code_idx[keep]), ledger['股數'].to_numpy()[keep])
+    positions = np.cumsum(deltas, axis=0)
+    prices = np.nan_to_num(closes.ffill().to_numpy())
+    return pd.Series((positions * prices).sum(axis=1), index=dates, name='總市值')
+
+def build_nav_history(records_df):
+    """由交易紀錄重建每日總市值 DataFrame(日期, 總市值)"""
+    ledger = get_ledger_quantities(records_df)
+    if ledger.empty:
+        return pd.DataFrame(columns=['日期', '總市值'])
+    
+    start = ledger['日期'].min().strftime('%Y-%m-%d')
+    nav = reconstruct_nav(ledger, get_price_history(ledger['股票代號'].unique(), start))
+    nav = nav[nav > 0]
+    return pd.DataFrame({'日期': nav.index, '總市值': nav.to_numpy()})
+
+# 優化13: 交易寫入後直接更新快取中的持股(write-through),背景再與試算表同步
+def apply_trade_to_holdings(holdings_df, trade):
+    """將一筆交易套用到總覽與損益DataFrame"""
+    if not all(col in holdings_df.columns for col in HOLDINGS_METRIC_COLUMNS):
+        return holdings_df
+    
+    holdings_df = holdings_df.copy()
+    matches = holdings_df['股票代號'].astype(str).str.strip() == trade['stock_code']
+    
+    if matches.any():
+        holdings_df.loc[matches, '總投入成本'] += trade['total_amount']
+        holdings_df.loc[matches, '總持有股數'] += trade['final_quantity']
+    elif trade['new_holding']:
+        new_row = {col: 0.0 if pd.api.types.is_numeric_dtype(holdings_df[col]) else '' for col in holdings_df.columns}
+        new_row.update({
+            '股票代號': trade['stock_code'],
+            '股票名稱': trade['stock_name'],
+            '總投入成本': trade['total_amount'],
+            '總持有股數': trade['final_quantity'],
+            '目前股價': trade['stock_price']  # 以成交價暫代,同步後改為試算表股價
+        })
+        holdings_df = pd.concat([holdings_df, pd.DataFrame([new_row])], ignore_index=True)
+        matches = holdings_df['股票代號'] == trade['stock_code']
+    else:
+        return holdings_df
     
-    try:
-        config = SHEET_CONFIGS['ed_overseas']['cathay']
-        sheet_id = config['id']
-        range_name = config.get('dca_range')
-        
-        if not range_name:
-            return pd.DataFrame()
-        
-        result = service.spreadsheets().values().get(
-            spreadsheetId=sheet_id,
-            range=range_name
-        ).execute()
-        
-        values = result.get('values', [])
-        if not values or len(values) < 2:
-            return pd.DataFrame()
-        
-        max_cols = len(values[0]) if values else 0
-        normalized_values = [row + [''] * (max_cols - len(row)) for row in values]
-        
-        df = pd.DataFrame(normalized_values[1:], columns=normalized_values[0])
-        df = df.dropna(how='all')
-        
-        # 處理數字欄位 - 使用更靈活的欄位匹配
-        numeric_columns = []
-        for col in df.columns:
-            if any(keyword in col for keyword in ['金額', '扣款', '折扣', '價']):
-                numeric_columns.append(col)
-        
-        for col in numeric_columns:
-            if col in df.columns:
-                df[col] = df[col].apply(parse_number)
-        
-        return df
-        
-    except Exception as e:
-        st.error(f"載入國泰證券定期定額設定失敗: {str(e)}")
-        return pd.DataFrame()
+    return recalculate_holdings_metrics(holdings_df, matches)
+
+def apply_trade_to_records(records_df, trade):
+    """將一筆交易附加到交易紀錄DataFrame"""
+    if records_df.empty or len(records_df.columns) < 7:
+        return records_df
+    
+    date_value = trade['transaction_date']
+    if pd.api.types.is_datetime64_any_dtype(records_df.iloc[:, 0]):
+        date_value = pd.Timestamp(date_value)
+    else:
+        date_value = date_value.strftime('%Y/%m/%d')
+    
+    row = [date_value, trade['stock_code'], trade['stock_price'], '', '', trade['total_amount'], trade['final_quantity']]
+    row += [''] * (len(records_df.columns) - len(row))
+    return pd.concat([records_df, pd.DataFrame([row], columns=records_df.columns)], ignore_index=True)
+
+def record_pending_trade(person, trade):
+    """記錄已寫入但尚未同步回快取的交易,並在背景與試算表同步"""
+    sheet_id = SHEET_CONFIGS[person]['id']
+    pending_trades = st.session_state.setdefault('pending_trades', {})
+    pending_trades.setdefault(person, []).append({**trade, 'submitted_at': time.time()})
+    
+    affected = {'交易紀錄', *WORKSHEET_DEPENDENCIES['交易紀錄']}
+    range_names = [source[2] for source in get_person_sources(person) if get_worksheet_name(source[2]) in affected]
+    service = get_google_sheets_service()
+    if service and range_names:
+        refresh_snapshots_in_background(service, sheet_id, range_names, delay=1, force=True)
+
+def get_holdings_synced_at(person):
+    """持股工作表最近一次完成的背景更新的發出時間(須在載入數據之前取得)"""
+    return get_synced_at(SHEET_CONFIGS[person]['id'], '總覽與損益')
+
+def apply_pending_trades(person, person_data, synced_at):
+    """將尚未同步的交易套用到載入的數據,送出之後才發出的更新完成時才移除該筆交易"""
+    pending_trades = st.session_state.get('pending_trades', {}).get(person)
+    if not pending_trades:
+        return person_data
+    
+    pending_trades[:] = [trade for trade in pending_trades if synced_at <= trade['submitted_at']]
+    
+    person_data = dict(person_data)
+    for trade in pending_trades:
+        person_data['holdings'] = apply_trade_to_holdings(person_data['holdings'], trade)
+        if 'trading_records' in person_data:
+            person_data['trading_records'] = apply_trade_to_records(person_data['trading_records'], trade)
+    
+    # 有交易紀錄時以部位引擎重新計算,避免與上面的逐筆套用重複累計
+    if not person_data.get('trading_records', pd.DataFrame()).empty:
+        person_data['holdings'] = derive_holdings(person_data['holdings'], compute_positions(person_data['trading_records']))
+    return person_data
 
 def get_schwab_total_value(schwab_df):
     """從schwab工作表的B欄取得最下方的總市值數據"""
@@ -772,119 +2270,178 @@ def get_schwab_total_value(schwab_df):
         st.error(f"解析嘉信證券總市值失敗: {e}")
         return 0.0
 
-def get_cathay_total_value(cathay_df):
-    """從總覽與損益工作表的F欄計算總市值"""
-    try:
-        if cathay_df.empty or len(cathay_df.columns) < 6:
-            return 0.0
-        
-        f_column = cathay_df.iloc[:, 5]
-        
-        total = 0.0
-        for value in f_column:
-            if pd.notna(value) and str(value).strip() != '':
-                parsed_value = parse_number(value)
-                if parsed_value > 0:
-                    total += parsed_value
-        
-        return total
-    except Exception as e:
-        st.error(f"計算國泰證券總市值失敗: {e}")
-        return 0.0
+# 優化19: 資產配置計算 - 各來源正規化為 (類別, 市值, 幣別) 後一次換匯與彙總
+ALLOCATION_FRAME_COLUMNS = ['類別', '市值', '幣別']
 
-def get_fubon_uk_total_value(fubon_df):
-    """計算富邦英股總市值"""
-    try:
-        if fubon_df.empty:
-            return 0.0, 0.0
-        
-        value_usd_col = None
-        value_ntd_col = None
-        
-        for col in fubon_df.columns:
-            if '市值' in col and 'USD' in col:
-                value_usd_col = col
-            elif '市值' in col and 'NTD' in col:
-                value_ntd_col = col
-        
-        total_value_usd = fubon_df[value_usd_col].sum() if value_usd_col else 0
-        total_value_ntd = fubon_df[value_ntd_col].sum() if value_ntd_col else 0
-        
-        return total_value_usd, total_value_ntd
-        
-    except Exception as e:
-        st.error(f"計算富邦英股總市值失敗: {e}")
-        return 0.0, 0.0
+def to_category_series(series):
+    """將類別欄轉為去除空白的字串,空值視為空字串"""
+    return series.where(series.notna(), '').astype(str).str.strip()
+
+def normalize_holdings_allocation(holdings_df):
+    """台股持股 -> (類別, 市值, 幣別)"""
+    if holdings_df.empty or '類別' not in holdings_df.columns or '目前總市值' not in holdings_df.columns:
+        return pd.DataFrame(columns=ALLOCATION_FRAME_COLUMNS)
+    return pd.DataFrame({
+        '類別': to_category_series(holdings_df['類別']),
+        '市值': parse_number_series(holdings_df['目前總市值']),
+        '幣別': 'TWD'
+    })
+
+def normalize_schwab_allocation(schwab_df):
+    """嘉信證券 -> 總市值全數歸入美股個股"""
+    schwab_total_usd = get_schwab_total_value(schwab_df)
+    if schwab_total_usd <= 0:
+        return pd.DataFrame(columns=ALLOCATION_FRAME_COLUMNS)
+    return pd.DataFrame({'類別': ['美股個股'], '市值': [schwab_total_usd], '幣別': ['USD']})
+
+def get_category_column(df, index):
+    """取得指定位置的類別欄,欄位不足時視為未分類"""
+    if len(df.columns) > index:
+        return to_category_series(df.iloc[:, index])
+    return pd.Series('', index=df.index)
+
+def find_value_column_index(df, currency):
+    """找出「市值」且標示指定幣別的欄位位置"""
+    return next((i for i, col in enumerate(df.columns) if '市值' in col and currency in col), None)
+
+def normalize_cathay_allocation(cathay_df):
+    """國泰證券 -> 類別取自I欄(索引8),市值取自F欄(索引5)"""
+    if cathay_df.empty or len(cathay_df.columns) < 6:
+        return pd.DataFrame(columns=ALLOCATION_FRAME_COLUMNS)
+    frame = pd.DataFrame({
+        '類別': get_category_column(cathay_df, 8),
+        '市值': parse_number_series(cathay_df.iloc[:, 5]),
+        '幣別': 'USD'
+    })
+    return frame[frame['市值'] > 0]
+
+def normalize_fubon_uk_allocation(fubon_df):
+    """富邦英股 -> 類別取自M欄(索引12),市值優先取原幣GBP市值欄(以匯率矩陣換算),沒有時取USD市值欄"""
+    currency, value_col_idx = 'USD', None
+    if not fubon_df.empty:
+        for currency in ('GBP', 'USD'):
+            value_col_idx = find_value_column_index(fubon_df, currency)
+            if value_col_idx is not None:
+                break
+    if value_col_idx is None:
+        return pd.DataFrame(columns=ALLOCATION_FRAME_COLUMNS)
+    frame = pd.DataFrame({
+        '類別': get_category_column(fubon_df, 12),
+        '市值': parse_number_series(fubon_df.iloc[:, value_col_idx]),
+        '幣別': currency
+    })
+    return frame[frame['市值'] > 0]
+
+ALLOCATION_NORMALIZERS = {
+    'rita': normalize_holdings_allocation,
+    'ed': normalize_holdings_allocation,
+    'schwab': normalize_schwab_allocation,
+    'cathay': normalize_cathay_allocation,
+    'fubon_uk': normalize_fubon_uk_allocation
+}
+
+# 新增:衍生指標層 - 各來源的總市值與類別小計依內容雜湊快取,海外總覽與資產配置共用同一份結果
+@st.cache_resource
+def get_derived_metrics_cache():
+    """各來源的 (內容雜湊, 衍生指標)(整個程序共用)"""
+    return {'lock': threading.Lock(), 'metrics': {}}
+
+def hash_frame(df):
+    """計算 DataFrame 內容(含欄名)的雜湊值"""
+    digest = hashlib.sha1('\x1f'.join(map(str, df.columns)).encode('utf-8'))
+    if not df.empty:
+        digest.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+def compute_source_metrics(source, df):
+    """由正規化後的來源計算各幣別的總市值(原幣)與依 (類別, 幣別) 加總的小計"""
+    frame = ALLOCATION_NORMALIZERS[source](df)
+    # 小計保留原幣別,匯率變動時不需重算
+    return {
+        'totals': frame.groupby('幣別')['市值'].sum().to_dict(),
+        'breakdown': frame.groupby(['類別', '幣別'], as_index=False)['市值'].sum()
+    }
+
+def get_source_metrics(source, df):
+    """取得單一來源的衍生指標,內容未變時直接使用快取"""
+    content_hash = hash_frame(df)
+    state = get_derived_metrics_cache()
+    with state['lock']:
+        cached = state['metrics'].get(source)
+    if cached is not None and cached[0] == content_hash:
+        return cached[1]
+    
+    metrics = compute_source_metrics(source, df)
+    with state['lock']:
+        state['metrics'][source] = (content_hash, metrics)
+    return metrics
+
+def convert_totals(totals, currency, fx_rates):
+    """將各幣別總市值以匯率矩陣換算為指定幣別"""
+    return sum(
+        amount if amount_currency == currency else amount * fx_rates[amount_currency] / fx_rates[currency]
+        for amount_currency, amount in totals.items()
+    )
+
+def get_overseas_totals(ed_overseas_data, fx_rates=None):
+    """海外各券商總市值 (schwab_usd, cathay_usd, fubon_usd, fubon_ntd),跨幣別以匯率矩陣換算"""
+    fx_rates = fx_rates or get_fx_rates()
+    totals = {
+        source: get_source_metrics(source, ed_overseas_data.get(source, pd.DataFrame()))['totals']
+        for source in ('schwab', 'cathay', 'fubon_uk')
+    }
+    return (
+        convert_totals(totals['schwab'], 'USD', fx_rates),
+        convert_totals(totals['cathay'], 'USD', fx_rates),
+        convert_totals(totals['fubon_uk'], 'USD', fx_rates),
+        convert_totals(totals['fubon_uk'], 'TWD', fx_rates)
+    )
+
+def aggregate_allocation(frames, fx_rates):
+    """合併各來源,以匯率欄向量化換算台幣後依類別加總"""
+    frames = [frame for frame in frames if not frame.empty]
+    combined = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=ALLOCATION_FRAME_COLUMNS)
+    combined['value_twd'] = convert_to_twd(combined['市值'].astype('float64'), combined['幣別'], fx_rates).fillna(0.0)
+    return combined.groupby('類別')['value_twd'].sum().reindex(list(TARGET_ALLOCATION.keys()), fill_value=0.0)
 
-# 優化6: 快取資產配置計算
-@st.cache_data(ttl=1800)
 def get_asset_allocation_data():
-    """計算資產配置數據 - 添加快取"""
+    """計算資產配置數據 - 並行載入所有試算表與匯率"""
     try:
-        usd_twd_rate = get_usd_twd_rate()
-        allocation_data = {category: {'value_twd': 0.0, 'percentage': 0.0} for category in TARGET_ALLOCATION.keys()}
-        
-        # 批次載入所有需要的數據
-        rita_data = load_person_all_data('rita')
-        ed_data = load_person_all_data('ed')
-        ed_overseas_data = load_person_all_data('ed_overseas')
-        
-        # 處理台股數據
-        for person_data in [rita_data, ed_data]:
-            holdings_df = person_data.get('holdings', pd.DataFrame())
-            if not holdings_df.empty and '類別' in holdings_df.columns and '目前總市值' in holdings_df.columns:
-                for _, row in holdings_df.iterrows():
-                    category = row.get('類別', '').strip()
-                    if category in allocation_data:
-                        value_twd = parse_number(row.get('目前總市值', 0))
-                        allocation_data[category]['value_twd'] += value_twd
-        
-        # 處理海外投資
-        schwab_total_usd = get_schwab_total_value(ed_overseas_data.get('schwab', pd.DataFrame()))
-        if schwab_total_usd > 0:
-            allocation_data['美股個股']['value_twd'] += schwab_total_usd * usd_twd_rate
-        
-        # 國泰證券處理
-        cathay_df = ed_overseas_data.get('cathay', pd.DataFrame())
-        if not cathay_df.empty and len(cathay_df.columns) >= 9:
-            for _, row in cathay_df.iterrows():
-                if len(row) > 8:
-                    category = str(row.iloc[8]).strip() if pd.notna(row.iloc[8]) else ''  # 從第9欄（索引8，即I欄）讀取類別
-                    if category in allocation_data and len(row) > 5:
-                        value_usd = parse_number(row.iloc[5])
-                        if value_usd > 0:
-                            allocation_data[category]['value_twd'] += value_usd * usd_twd_rate
-        
-        # 富邦英股處理
-        fubon_df = ed_overseas_data.get('fubon_uk', pd.DataFrame())
-        if not fubon_df.empty and len(fubon_df.columns) >= 13:
-            value_usd_col_idx = None
-            for i, col in enumerate(fubon_df.columns):
-                if '市值' in col and 'USD' in col:
-                    value_usd_col_idx = i
-                    break
-            
-            if value_usd_col_idx is not None:
-                for _, row in fubon_df.iterrows():
-                    if len(row) > max(12, value_usd_col_idx):
-                        category = str(row.iloc[12]).strip() if pd.notna(row.iloc[12]) else ''
-                        if category in allocation_data:
-                            value_usd = parse_number(row.iloc[value_usd_col_idx])
-                            if value_usd > 0:
-                                allocation_data[category]['value_twd'] += value_usd * usd_twd_rate
+        # 同時發出所有 Sheets 與匯率請求,等待全部完成後再彙總
+        results = fan_out({
+            'rita': lambda: load_person_all_data('rita'),
+            'ed': lambda: load_person_all_data('ed'),
+            'ed_overseas': lambda: load_person_all_data('ed_overseas'),
+            'fx': get_fx_rates
+        }, timeouts={'fx': FX_TIMEOUT_SECONDS})
+        
+        # 匯率逾時不設定 retry_after,背景中的請求完成後仍會寫入快取供下次使用
+        fx_rates = results['fx'] if results['fx'] is not None else use_fallback_fx_rates()
+        ed_overseas_data = results['ed_overseas'] or {}
+        
+        source_frames = {
+            'rita': (results['rita'] or {}).get('holdings', pd.DataFrame()),
+            'ed': (results['ed'] or {}).get('holdings', pd.DataFrame()),
+            'schwab': ed_overseas_data.get('schwab', pd.DataFrame()),
+            'cathay': ed_overseas_data.get('cathay', pd.DataFrame()),
+            'fubon_uk': ed_overseas_data.get('fubon_uk', pd.DataFrame())
+        }
+        breakdowns = [get_source_metrics(source, df)['breakdown'] for source, df in source_frames.items()]
+        category_values = aggregate_allocation(breakdowns, fx_rates)
         
         # 計算百分比
-        total_value = sum([data['value_twd'] for data in allocation_data.values()])
-        
-        if total_value > 0:
-            for category in allocation_data:
-                allocation_data[category]['percentage'] = (allocation_data[category]['value_twd'] / total_value) * 100
+        total_value = float(category_values.sum())
+        percentages = category_values / total_value * 100 if total_value > 0 else category_values * 0.0
+        allocation_data = {
+            category: {'value_twd': float(category_values[category]), 'percentage': float(percentages[category])}
+            for category in TARGET_ALLOCATION.keys()
+        }
         
-        return allocation_data, total_value, usd_twd_rate
+        return allocation_data, total_value, fx_rates['USD']
         
     except Exception as e:
         st.error(f"計算資產配置失敗: {e}")
-        return {}, 0.0, 31.0
+        return {}, 0.0, FX_FALLBACK_RATE
 
 # 優化7: 快取格式化函數
 @st.cache_data
@@ -1054,7 +2611,8 @@ def render_asset_allocation_summary(allocation_data, total_value, usd_twd_rate):
     with col1:
         st.markdown(f'<div class="metric-card"><div class="metric-label">總資產</div><div class="metric-value">{format_currency(total_value)}</div></div>', unsafe_allow_html=True)
     with col2:
-        st.markdown(f'<div class="metric-card"><div class="metric-label">USD/TWD 匯率</div><div class="metric-value">{usd_twd_rate:.2f}</div></div>', unsafe_allow_html=True)
+        rate_label = 'USD/TWD 匯率 (備用)' if get_fx_fallback_state()['is_fallback'] else 'USD/TWD 匯率'
+        st.markdown(f'<div class="metric-card"><div class="metric-label">{rate_label}</div><div class="metric-value">{usd_twd_rate:.2f}</div></div>', unsafe_allow_html=True)
     
     comparison_df = pd.DataFrame({
         '資產類別': categories,
@@ -1267,16 +2825,41 @@ def render_overseas_portfolio_chart(df, broker_name):
     except Exception:
         pass  # 靜默處理錯誤,避免影響主要流程
 
-def render_trend_chart(trend_df):
-    """渲染趨勢圖表 - 優化版本"""
-    if trend_df.empty:
+def render_schwab_trend_chart(schwab_df):
+    """渲染嘉信證券市值趨勢 - 以每日匯率歷史將 USD 市值換算為台幣"""
+    if schwab_df.empty or len(schwab_df.columns) < 2:
+        return
+    try:
+        history = pd.Series(
+            parse_number_series(schwab_df.iloc[:, 1]).to_numpy(),
+            index=pd.to_datetime(schwab_df.iloc[:, 0], errors='coerce')
+        )
+        history = history[history.index.notna() & (history > 0)].sort_index()
+        if history.empty:
+            return
+        
+        history_twd = convert_history_to_twd(history, 'USD')
+        fig = make_subplots(specs=[[{"secondary_y": True}]])
+        fig.add_trace(go.Scatter(x=history.index, y=history.values, mode='lines+markers', name='總市值 (USD)', line=dict(color='#1f4e79', width=2)), secondary_y=False)
+        fig.add_trace(go.Scatter(x=history_twd.index, y=history_twd.values, mode='lines', name='總市值 (NT$,當日匯率)', line=dict(color='#95a5a6', width=1.5, dash='dot')), secondary_y=True)
+        fig.update_layout(title='嘉信證券市值趨勢', hovermode='x unified', template="plotly_white", height=400)
+        fig.update_yaxes(title_text='USD', secondary_y=False)
+        fig.update_yaxes(title_text='NT$', secondary_y=True)
+        st.plotly_chart(fig, use_container_width=True)
+    except Exception:
+        st.warning("嘉信證券市值趨勢載入失敗")
+
+def render_trend_chart(trend_df, nav_df=None):
+    """渲染趨勢圖表 - 手動紀錄與交易紀錄回推的每日總市值"""
+    nav_df = nav_df if nav_df is not None else pd.DataFrame()
+    if trend_df.empty and nav_df.empty:
         st.info("查無資產趨勢數據。")
         return
         
     try:
         required_columns = ['日期', '總市值']
-        if not all(col in trend_df.columns for col in required_columns):
-            return
+        if trend_df.empty or not all(col in trend_df.columns for col in required_columns):
+            trend_df = pd.DataFrame(columns=required_columns)
         
         trend_df = trend_df.copy()
         
@@ -1284,24 +2867,30 @@ def render_trend_chart(trend_df):
         trend_df['日期'] = pd.to_datetime(trend_df['日期'], errors='coerce')
         trend_df = trend_df.dropna(subset=['日期'])
         
-        if trend_df.empty:
-            return
-        
-        trend_df['總市值'] = trend_df['總市值'].apply(parse_number)
+        trend_df['總市值'] = parse_number_series(trend_df['總市值'])
         trend_df = trend_df[trend_df['總市值'] > 0]
         
-        if trend_df.empty:
+        if trend_df.empty and nav_df.empty:
             return
         
         fig = go.Figure()
-        fig.add_trace(go.Scatter(
-            x=trend_df['日期'], 
-            y=trend_df['總市值'], 
-            mode='lines+markers', 
-            name='總市值',
-            line=dict(color='#3498db', width=2),
-            marker=dict(size=6, color='#3498db')
-        ))
+        if not nav_df.empty:
+            fig.add_trace(go.Scatter(
+                x=nav_df['日期'],
+                y=nav_df['總市值'],
+                mode='lines',
+                name='每日市值(交易紀錄回推)',
+                line=dict(color='#95a5a6', width=1.5)
+            ))
+        if not trend_df.empty:
+            fig.add_trace(go.Scatter(
+                x=trend_df['日期'], 
+                y=trend_df['總市值'], 
+                mode='lines+markers', 
+                name='總市值',
+                line=dict(color='#3498db', width=2),
+                marker=dict(size=6, color='#3498db')
+            ))
         fig.update_layout(
             title='資產趨勢', 
             xaxis_title='日期', 
@@ -1315,6 +2904,24 @@ def render_trend_chart(trend_df):
     except Exception:
         st.warning("資產趨勢圖載入失敗")
 
+def render_cache_stats():
+    """顯示試算表內容指紋的命中統計與 Sheets 請求合併統計"""
+    state = get_frame_fingerprints()
+    flight_state = get_singleflight_state()
+    with st.expander("🗄️ 快取統計"):
+        col1, col2, col3, col4, col5 = st.columns(5)
+        with col1:
+            st.metric("內容未變(沿用)", f"{state['hits']:,}")
+        with col2:
+            st.metric("重新解析", f"{state['misses']:,}")
+        with col3:
+            total = state['hits'] + state['misses']
+            st.metric("命中率", f"{state['hits'] / total * 100:.1f}%" if total else "-")
+        with col4:
+            st.metric("Sheets 請求", f"{flight_state['fetches']:,}")
+        with col5:
+            st.metric("合併的請求", f"{flight_state['coalesced']:,}")
+
 # 優化9: 主函數流程優化
 def main():
     """主要應用程式邏輯 - 優化版本"""
@@ -1326,8 +2933,9 @@ def main():
     # 優化:只在需要時顯示更新按鈕
     col1, col2, col3 = st.columns([1, 1, 8])
     with col2:
-        if st.button('🔄 更新', key='refresh_button', help='清除快取並重新載入數據'):
-            st.cache_data.clear()
+        if st.button('🔄 更新', key='refresh_button', help='清除目前頁面的快取並重新載入數據'):
+            for refresh_person in (['rita', 'ed', 'ed_overseas'] if person == 'asset_allocation' else [person]):
+                invalidate_person_data(refresh_person)
             st.rerun()
 
     # 優化:條件式載入,只載入當前用戶的數據
@@ -1374,9 +2982,7 @@ def main():
         cathay_df = ed_overseas_data['cathay']
         fubon_df = ed_overseas_data['fubon_uk']
 
-        schwab_total_usd = get_schwab_total_value(schwab_df)
-        cathay_total_usd = get_cathay_total_value(cathay_df)
-        fubon_total_usd, fubon_total_ntd = get_fubon_uk_total_value(fubon_df)
+        schwab_total_usd, cathay_total_usd, fubon_total_usd, fubon_total_ntd = get_overseas_totals(ed_overseas_data)
         
         render_ed_overseas_summary(schwab_total_usd, cathay_total_usd, fubon_total_usd, fubon_total_ntd)
         
@@ -1409,12 +3015,14 @@ def main():
                 if success:
                     st.success("紀錄已成功新增!正在重新整理數據...")
                     time.sleep(1)
-                    st.cache_data.clear()
+                    invalidate_worksheets(sheet_id, [worksheet_name])
                     st.rerun()
                 else:
                     st.error("新增紀錄失敗,請檢查後台日誌或 API 權限。")
             
             st.divider()
+            
+            render_schwab_trend_chart(schwab_df)
 
             col1, col2 = st.columns(2)
             with col1:
@@ -1469,7 +3077,9 @@ def main():
         
         # 優化:使用批次載入
         with st.spinner(f'載入 {person} 的投資數據...'):
-            person_data = load_person_all_data(person)
+            # 先取得同步時間再載入,避免在載入舊數據之後才移除待同步的交易
+            synced_at = get_holdings_synced_at(person)
+            person_data = apply_pending_trades(person, load_person_all_data(person), synced_at)
         
         holdings_df = person_data['holdings']
         dca_df = person_data['dca']
@@ -1482,7 +3092,8 @@ def main():
             if person in ['rita', 'ed']:
                 st.markdown("---")
                 st.header("📝 交易記錄管理")
-                render_trading_form_for_person(person)
+                render_trading_form_for_person(person, holdings_df)
+                render_bulk_import_for_person(person, holdings_df, person_data.get('trading_records', pd.DataFrame()))
                 st.markdown("---")
             
             tab1, tab2, tab3 = st.tabs(["📈 持股明細", "🥧 持股分佈", "📊 資產趨勢"])
@@ -1495,9 +3106,12 @@ def main():
                 render_portfolio_chart(holdings_df, person)
             with tab3:
                 st.subheader("資產趨勢")
-                render_trend_chart(trend_df)
+                render_trend_chart(trend_df, build_nav_history(person_data.get('trading_records', pd.DataFrame())))
         else:
             st.warning(f"無法載入 {person} 的投資數據,或數據為空。")
+    
+    st.markdown("---")
+    render_cache_stats()
 
 if __name__ == "__main__":
     main()